@@ -1,28 +1,140 @@
 import requests
+from urllib3.util.retry import Retry
 import time
+import os
+import random
+import shutil
 import sys
-from pandas import DataFrame
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Iterable
+from constants import BASE_URL
+from fast_json import dumps, loads
+from journal import Journal
+import reconcile
+from metrics import (
+    InstrumentedAdapter,
+    Metrics,
+    connection_timings,
+    reset_connection_timings,
+)
+from reference import REFERENCE_ENDPOINTS, ReferenceCache
+from scheduler import STREAM_LOOKAHEAD, MembershipScheduler
+from report import (
+    RECONCILED_REPORT_FIELDS,
+    DeadLetterWriter,
+    ReportWriter,
+    Response,
+    Results,
+    classify,
+)
+from throttle import RateLimiter, retry_after
+from token_cache import TokenCache, token_expiry
+
+TOKEN_REFRESH_MARGIN = 120  # Seconds before expiry at which a token is refreshed.
+RETRY_BACKOFF = 0.5  # Seconds; base delay of transient retries, doubled per attempt.
+RETRY_BACKOFF_MAX = 30
+# Connections kept per host. Callers with more requests in flight pass a larger pool.
+POOL_SIZE = 16
 
 
 class ConnectionFailed(Exception):
     pass
 
 
+def status_message(response: requests.Response) -> str:
+    """Returns status.message of a Gym Manager response. Responses without one (e.g. an HTML error page from a proxy) give the start of the body or the HTTP reason instead."""
+    try:
+        return loads(response.content)["status"]["message"]
+    except (ValueError, KeyError, TypeError):
+        return response.text[:200].strip() or response.reason
+
+
 class GymManager:
-    def __init__(self):
-        """Initializes connection with Gym Manager API. Use your credentials to log in."""
-        self.base_url = "https://trainmore-apiv6.gymmanager.eu/api/v1"
+    def __init__(
+        self,
+        pool_size: int = POOL_SIZE,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+        retries: int = 3,
+        rate_limit: float = 20.0,
+        throttle_retries: int = 5,
+        transient_retries: int = 3,
+        base_url: str = BASE_URL,
+        token_cache: TokenCache = None,
+        reference_cache: ReferenceCache = None,
+    ):
+        """Initializes connection with Gym Manager API. Use your credentials to log in. All calls share one pooled keep-alive session; uploads are paced by an adaptive rate limiter starting at `rate_limit` requests per second. Tokens and reference data are only cached on disk when a `token_cache` / `reference_cache` is given."""
+        self.base_url = base_url
         self.authentication_response = {}
         self.headers = {}
-        self.responses = []
+        self.token_expires_at = 0.0
+        self.token_cache = token_cache
+        self.auth_lock = threading.Lock()
+        self.reference_cache = reference_cache
+        self.reference = None
+        self.responses = Results()
+        self.processed = 0
+        self.failures = 0  # Rows of the last post_data without a 2xx response.
         self.duration = 0
+        self.metrics = Metrics()
+        self.skipped = 0
+        self.blocked = 0
+        self.report_path = "report.csv"
+        self.dead_letter_path = None
+        self.dead_letters = 0
+        self.reconciled = None  # Result counts of the last reconcile().
+        self.cancel_event = threading.Event()
+        self.unpaused = threading.Event()
+        self.unpaused.set()
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = self.create_session(pool_size=pool_size, retries=retries)
+        self.limiter = RateLimiter(rate=rate_limit)
+        self.throttle_retries = throttle_retries
+        self.transient_retries = transient_retries
+
+    @staticmethod
+    def create_session(pool_size: int, retries: int) -> requests.Session:
+        """Returns a pooled session. At this level POSTs are only retried when the request was never sent; _post_row additionally re-sends them after read timeouts and 5xx, so a change may be applied more than once. That is accepted because a PeopleMembershipChange sets the same schedule for the same referenceDate."""
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            backoff_factor=0.5,
+            raise_on_status=False,
+        )
+        adapter = InstrumentedAdapter(pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
 
     def authenticate(self, user_name: str, password: str) -> None:
+        """Logs in, or reuses a cached token for the same credentials that is not about to expire."""
         self.user_name = user_name
         self.password = password
 
-        self.authentication_response = requests.post(
-            url="https://trainmore-apiv6.gymmanager.eu/api/v1/Authorize/AuthenticateJson",
+        if self.token_cache is not None:
+            cached = self.token_cache.load(
+                base_url=self.base_url,
+                user_name=user_name,
+                password=password,
+                margin=TOKEN_REFRESH_MARGIN,
+            )
+            if cached is not None:
+                print("Reusing cached authentication token.")
+                self.set_token(*cached)
+                return
+
+        self.login()
+
+    def login(self) -> None:
+        """Requests a new bearer token with the stored credentials."""
+        self.authentication_response = self.session.post(
+            url=f"{self.base_url}/Authorize/AuthenticateJson",
             json={
                 "username": self.user_name,
                 "password": self.password,
@@ -30,27 +142,62 @@ class GymManager:
                 "macAddress": "",
             },
             headers={"Accept": "application/json", "Content-Type": "application/json"},
+            timeout=self.timeout,
         ).json()
 
-        print(self.authentication_response)
-
         if self.authentication_response["status"]["success"] == False:
             raise ConnectionFailed(
-                f"Code: {self.authentication_response['status']['code']}, Message: {self.authentication_response['status']['message']}"
+                f"Code: {self.authentication_response['status'].get('code')}, Message: {self.authentication_response['status'].get('message')}"
             )
         else:
-            print(self.authentication_response)
-            self.headers = {
-                "Authorization": f"{self.authentication_response['data']}",
-                "Accept": "application/json",
-                "Content-Type": "application/json",
-            }
+            token = f"{self.authentication_response['data']}"
+            self.set_token(token, token_expiry(token))
+
+            if self.token_cache is not None:
+                self.token_cache.store(
+                    base_url=self.base_url,
+                    user_name=self.user_name,
+                    password=self.password,
+                    token=token,
+                    expires_at=self.token_expires_at,
+                )
+
+    def set_token(self, token: str, expires_at: float) -> None:
+        self.token_expires_at = expires_at
+        self.headers = {
+            "Authorization": token,
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+        }
+
+    def refresh_token(self, stale_headers: dict) -> None:
+        """Logs in again unless another thread already replaced the token in `stale_headers`."""
+        with self.auth_lock:
+            if self.headers is stale_headers:
+                self.login()
+
+    def current_headers(self) -> dict:
+        """Returns the auth headers, refreshing the token first when it expires within TOKEN_REFRESH_MARGIN."""
+        headers = self.headers
+        if (
+            self.token_expires_at
+            and time.time() > self.token_expires_at - TOKEN_REFRESH_MARGIN
+        ):
+            self.refresh_token(stale_headers=headers)
+        return self.headers
 
     def connection_test(self) -> str:
         """Test the connection. Continue execution when response status code is 200."""
-        url = "https://trainmore-apiv6.gymmanager.eu/api/v1/Clubs?onlyActive=true"
+        url = f"{self.base_url}/Clubs?onlyActive=true"
         headers = self.headers
-        response = requests.get(url=url, headers=headers)
+        response = self.session.get(url=url, headers=headers, timeout=self.timeout)
+
+        if response.status_code == 401 and self.token_cache is not None:
+            # A cached token may have been revoked server-side; log in once and retry.
+            self.refresh_token(stale_headers=headers)
+            response = self.session.get(
+                url=url, headers=self.headers, timeout=self.timeout
+            )
 
         if response.status_code == 200:
             result = "Connection was successful!"
@@ -61,46 +208,373 @@ class GymManager:
 
         return result
 
-    def post_data(self, data: dict, callbck: None = None) -> list[dict]:
-        """Posts the transformed data to Gym Manager. Returns a report with status code and message per row."""
-        timestamp_start = time.time()
-        for i, row in enumerate(data):
-            response = requests.post(
-                url=row["url"], json=row["body"], headers=self.headers
-            )
+    def reference_data(self, refresh: bool = False) -> dict:
+        """Returns the known IDs per kind (paymentSchedules, promotions, articles) for pre-flight validation, upper-cased like input IDs. Served from the on-disk cache while it is fresh."""
+        if not refresh and self.reference is not None:
+            return self.reference
 
-            self.responses.append(
-                {
-                    "ppl_mshp_id": row["ppl_mshp_id"],
-                    "status_code": response.status_code,
-                    "message": response.json()["status"]["message"],
-                    "post_url": row["url"],
-                    "body": row["body"],
-                }
+        cached = (
+            None
+            if refresh or self.reference_cache is None
+            else self.reference_cache.load(self.base_url)
+        )
+        if cached is not None:
+            self.reference = cached
+            return self.reference
+
+        reference = {}
+        for kind, path in REFERENCE_ENDPOINTS.items():
+            response = self.session.get(
+                url=f"{self.base_url}{path}",
+                headers=self.current_headers(),
+                timeout=self.timeout,
+            )
+            try:
+                items = loads(response.content)["data"]
+            except (ValueError, KeyError, TypeError):
+                items = None  # E.g. an HTML error page or an unexpected JSON shape.
+            if response.status_code != 200 or not isinstance(items, list) or not items:
+                continue  # Kinds the API does not serve are simply not checked.
+            # The API may return lower-case GUIDs, input IDs are upper-case.
+            reference[kind] = frozenset(
+                str(item["id"]).upper()
+                for item in items
+                if isinstance(item, dict) and "id" in item
             )
 
-            progress = (i + 1) / len(data)
-            callbck(progress=progress, step=i, item_count=len(data))
-            print(progress)
+        if self.reference_cache is not None:
+            self.reference_cache.store(self.base_url, reference)
+        self.reference = reference
+        return self.reference
 
-            # report progress to console
+    def _post_row(self, row: dict) -> Response:
+        """Posts a single transformed row and returns its report entry. Throttled (429) rows are retried after the limiter backs off; a 401 triggers one re-login and retry. Other transient failures (transport errors, timeouts, 5xx) are retried with exponential backoff and jitter; permanent (4xx) failures are not."""
+        reauthenticated = False
+        throttled = 0
+        failures = 0
+        while True:
+            headers = self.current_headers()
+            queued = time.monotonic()
+            self.limiter.acquire()
+            start = time.monotonic()
+            response = error = None
+            try:
+                reset_connection_timings()
+                response = self.session.post(
+                    url=row["url"],
+                    data=row.get("payload") or dumps(row["body"]),
+                    headers=headers,
+                    timeout=self.timeout,
+                )
+            except requests.RequestException as request_error:
+                error = request_error
+            finally:
+                # The slot is handed back whatever the send raised, so no concurrency is lost.
+                total = time.monotonic() - start
+                if response is None:
+                    self.limiter.release(None, total)
+                else:
+                    self.limiter.release(
+                        response.status_code,
+                        total,
+                        retry_after(response.headers.get("Retry-After")),
+                    )
 
-            # sys.stdout.write("\r")
-            # sys.stdout.write("[%-20s] %d%%" % ("=" * int(20 * j), 100 * j))
-            # sys.stdout.flush()
+            if error is not None:
+                connect, tls = connection_timings()
+                self.metrics.record_request(
+                    None, start - queued, connect, tls, 0.0, 0.0, total, 0, 0
+                )
+                if failures < self.transient_retries and self.backoff(failures):
+                    failures += 1
+                    continue
+                self.metrics.record_row(
+                    throttle_retries=throttled, transient_retries=failures
+                )
+                return Response(
+                    ppl_mshp_id=row["ppl_mshp_id"],
+                    status_code=0,
+                    message=f"{type(error).__name__}: {error}",
+                    post_url=row["url"],
+                    body=row["body"],
+                )
+            self.record_request_metrics(response, start - queued, total)
+            if response.status_code == 401 and not reauthenticated:
+                self.refresh_token(stale_headers=headers)
+                reauthenticated = True
+            elif response.status_code == 429:
+                if throttled == self.throttle_retries:
+                    break
+                throttled += 1
+            elif (
+                classify(response.status_code) == "transient"
+                and failures < self.transient_retries
+                and self.backoff(failures)
+            ):
+                failures += 1
+            else:
+                break
+
+        self.metrics.record_row(throttle_retries=throttled, transient_retries=failures)
+        return Response(
+            ppl_mshp_id=row["ppl_mshp_id"],
+            status_code=response.status_code,
+            message=status_message(response),
+            post_url=row["url"],
+            body=row["body"],
+        )
+
+    def backoff(self, failures: int) -> bool:
+        """Sleeps before retry number `failures` + 1: a random time up to RETRY_BACKOFF * 2^failures seconds, capped at RETRY_BACKOFF_MAX ("full jitter"). Returns False without retrying when the upload is cancelled meanwhile."""
+        delay = random.uniform(0, min(RETRY_BACKOFF * 2**failures, RETRY_BACKOFF_MAX))
+        return not self.cancel_event.wait(timeout=delay)
+
+    def record_request_metrics(
+        self, response: requests.Response, queue: float, total: float
+    ) -> None:
+        """Splits one request's wall time into connect, TLS, server and transfer time and records it."""
+        connect, tls = connection_timings()
+        until_headers = response.elapsed.total_seconds()
+        retries = getattr(response.raw, "retries", None)
+        self.metrics.record_request(
+            status_code=response.status_code,
+            queue=queue,
+            connect=connect,
+            tls=tls,
+            server=max(until_headers - connect - tls, 0.0),
+            transfer=max(total - until_headers, 0.0),
+            total=total,
+            size=len(response.content),
+            retries=len(retries.history) if retries is not None else 0,
+        )
+
+    def post_data(
+        self,
+        data: Iterable[dict],
+        callbck: None = None,
+        concurrency: int = 1,
+        item_count: int = None,
+        journal: Journal = None,
+        report_path: str = None,
+        dead_letter_path: str = None,
+    ) -> list[Response]:
+        """Posts the transformed data to Gym Manager with up to `concurrency` requests in flight. Changes to one membership are sent one at a time, oldest referenceDate first; after a failure, that membership's later rows are not sent. Responses are written to the report file in input order as they arrive, and kept column-wise in self.responses unless `data` is streamed (has no length), which keeps memory flat; rows that still failed after all retries also go to the dead-letter file (default: next to the report). Rows already succeeded in the optional journal are skipped. `item_count`, the number of rows for progress reporting, may also be a function returning the current estimate."""
+        # `data` may be a generator (TransformData.Stream()); rows are only pulled as slots free up.
+        timestamp_start = time.time()
+        self.metrics = Metrics()
+        self.responses = Results()
+        self.processed = 0
+        self.failures = 0
+        self.skipped = 0
+        self.blocked = 0
+        self.reconciled = None
+        if report_path is not None:
+            self.report_path = report_path
+        self.dead_letter_path = (
+            dead_letter_path
+            or os.path.splitext(self.report_path)[0] + ".dead_letter.jsonl"
+        )
+        self.limiter.reset(concurrency=concurrency)
+        # Streamed rows are only counted; the report file holds them.
+        keep_responses = hasattr(data, "__len__")
+        if item_count is None and keep_responses:
+            item_count = len(data)
+        # A function gives a count that may change during the run, e.g. as a streamed file's invalid rows are skipped.
+        expected_count = item_count if callable(item_count) else lambda: item_count
+        scheduler = MembershipScheduler(
+            data, lookahead=None if keep_responses else STREAM_LOOKAHEAD
+        )
+        results = {}
+        next_index = 0
+        step = 0
+        exhausted = False
+        self.resume()
+
+        with ReportWriter(self.report_path) as report_writer, DeadLetterWriter(
+            self.dead_letter_path
+        ) as dead_letter_writer, ThreadPoolExecutor(
+            max_workers=max(1, concurrency)
+        ) as executor:
+            in_flight = {}
+
+            def submit(i: int, row: dict, failure: str) -> None:
+                completed = journal.completed(row) if journal is not None else None
+                if completed is None and failure is None:
+                    in_flight[executor.submit(self._post_row, row)] = (i, row, False)
+                else:
+                    future = Future()
+                    if completed is not None:
+                        future.set_result(completed)
+                        self.skipped += 1
+                    else:
+                        future.set_result(scheduler.blocked(row, failure))
+                        self.blocked += 1
+                    in_flight[future] = (i, row, completed is not None)
+
+            while True:
+                # No new rows are pulled while paused or after cancel; requests in flight always finish.
+                while (
+                    len(in_flight) < max(1, concurrency)
+                    and not exhausted
+                    and self.unpaused.is_set()
+                    and not self.cancel_event.is_set()
+                ):
+                    next_row = scheduler.next()
+                    if next_row is None:
+                        # Either all rows are handed out, or the rest wait for their membership's row in flight.
+                        exhausted = scheduler.done
+                        break
+                    submit(*next_row)
+
+                if not in_flight:
+                    if exhausted or self.cancel_event.is_set():
+                        break
+                    self.unpaused.wait(timeout=0.1)
+                    continue
+
+                done, _ = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    i, row, skipped = in_flight.pop(future)
+                    response = future.result()
+                    results[i] = (row, response)
+                    scheduler.complete(i, response)
+                    if journal is not None and not skipped:
+                        journal.record(response)
+
+                    expected = expected_count()
+                    progress = (step + 1) / expected if expected else None
+                    if callbck is not None:
+                        callbck(progress=progress, step=step, item_count=expected)
+                    step += 1
+
+                # Keep the report in input order, whatever order requests finish in.
+                while next_index in results:
+                    row, response = results.pop(next_index)
+                    if keep_responses:
+                        self.responses.append(row, response)
+                    report_writer.write(response)
+                    dead_letter_writer.write(response)
+                    next_index += 1
+
+            self.processed = report_writer.count
+            self.failures = report_writer.failed
+            self.dead_letters = dead_letter_writer.count
 
         timestamp_end = time.time()
         self.duration = round(timestamp_end - timestamp_start, 2)
+        self.metrics.finish()
+
+    def get_membership(self, ppl_mshp_id: str) -> tuple:
+        """Returns (status code, data) of a PeopleMembership, or (status code, message) when it could not be fetched. Paced by the rate limiter like uploads; transport errors give status 0."""
+        reauthenticated = False
+        throttled = 0
+        while True:
+            headers = self.current_headers()
+            self.limiter.acquire()
+            start = time.monotonic()
+            response = None
+            try:
+                response = self.session.get(
+                    url=f"{self.base_url}{reconcile.MEMBERSHIP_PATH}{ppl_mshp_id}",
+                    headers=headers,
+                    timeout=self.timeout,
+                )
+            except requests.RequestException as error:
+                return 0, f"{type(error).__name__}: {error}"
+            finally:
+                if response is None:
+                    self.limiter.release(None, time.monotonic() - start)
+                else:
+                    self.limiter.release(
+                        response.status_code,
+                        time.monotonic() - start,
+                        retry_after(response.headers.get("Retry-After")),
+                    )
+            if response.status_code == 401 and not reauthenticated:
+                self.refresh_token(stale_headers=headers)
+                reauthenticated = True
+            elif response.status_code == 429 and throttled < self.throttle_retries:
+                throttled += 1
+            else:
+                break
+
+        if response.status_code == 200:
+            try:
+                return 200, loads(response.content)["data"]
+            except (ValueError, KeyError, TypeError):
+                pass
+        return response.status_code, status_message(response)
+
+    def reconcile(
+        self,
+        sample: int = None,
+        concurrency: int = 8,
+        seed: int = None,
+        callbck: None = None,
+    ) -> dict:
+        """Checks that the memberships changed by the last post_data (not streamed, see post_data) now hold the uploaded payment schedule and articles. Per membership, the latest change in effect is compared with the membership fetched from the API; with a sample, only that many memberships are checked. Results (verified, mismatch, not found) are added to the report as a reconciliation column. Returns the result counts."""
+        self.responses.reconciliation.clear()
+        indexes = reconcile.targets(self.responses, sample=sample, seed=seed)
+        self.limiter.reset(concurrency=concurrency)
+
+        def check(i: int) -> str:
+            if self.cancel_event.is_set():
+                return None
+            response = self.responses[i]
+            return reconcile.result(
+                response, *self.get_membership(response.ppl_mshp_id)
+            )
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for step, (i, result) in enumerate(
+                zip(indexes, executor.map(check, indexes))
+            ):
+                if result is not None:
+                    self.responses.reconciliation[i] = result
+                if callbck is not None:
+                    callbck(
+                        progress=(step + 1) / len(indexes),
+                        step=step,
+                        item_count=len(indexes),
+                    )
+
+        with ReportWriter(
+            self.report_path, fields=RECONCILED_REPORT_FIELDS
+        ) as report_writer:
+            for response in self.responses:
+                report_writer.write(response)
+
+        self.reconciled = dict(reconcile.summary(self.responses))
+        return self.reconciled
+
+    def pause(self) -> None:
+        """Stops post_data from sending further rows until resume() is called."""
+        self.unpaused.clear()
+
+    def resume(self) -> None:
+        self.unpaused.set()
+
+    def cancel(self) -> None:
+        """Stops a running post_data after the requests in flight. Rows not yet sent are left out of the report."""
+        self.cancel_event.set()
+        self.resume()
+
+    def clear_cancel(self) -> None:
+        """Lets post_data run again after cancel(). Called by the caller when a new run starts, not by post_data, so a cancel() that arrives before post_data starts is not lost."""
+        self.cancel_event.clear()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
 
     def report(self) -> str:
         """Returns a report of all processed records and their status."""
-        return f"All {len(self.responses)} records processed.\nReport was saved to report.csv. Please check for errors.\nPosting these records took {self.duration} seconds.\nTime saved is {len(self.responses) * 5} minutes."
+        reconciled = ""
+        if self.reconciled is not None:
+            reconciled = f"\nReconciled {sum(self.reconciled.values())} memberships: {self.reconciled.get(reconcile.VERIFIED, 0)} verified, {self.reconciled.get(reconcile.MISMATCH, 0)} mismatched, {self.reconciled.get(reconcile.NOT_FOUND, 0)} not found, {self.reconciled.get(reconcile.UNVERIFIED, 0)} could not be checked."
+        return f"All {self.processed} records processed ({self.skipped} already uploaded in an earlier run, {self.blocked} not sent after an earlier change to the same membership failed).\nReport was saved to {self.report_path}. Please check for errors.\n{self.dead_letters} records still failed after retries; they were saved to {self.dead_letter_path} and can be replayed.\nPosting these records took {self.duration} seconds.\nTime saved is {self.processed * 5} minutes.\n{self.metrics.summary()}{reconciled}"
 
-    def export_report(self) -> None:
-        self.report = DataFrame(self.responses).to_csv(
-            "report.csv", sep=";", index=False
-        )
-        self.report_export = DataFrame(self.responses).to_csv(
-            sep=";", index=False, lineterminator="\n"
-        )
-        return self.report
+    def save_report(self, path: str) -> None:
+        """Saves a copy of the latest report to `path`."""
+        shutil.copyfile(self.report_path, path)
@@ -4,12 +4,22 @@ from PIL import Image, ImageTk
 import json
 from api import *
 from data import *
+from journal import *
+from reference import ReferenceCache
+from report import read_failures
+from results_view import ResultsIndex, ResultsWindow
+from token_cache import TokenCache
 import datetime
+from collections import deque
+import queue
+import threading
 from constants import *
 import matplotlib.colors as mcolors
 
 
-api = GymManager()
+api = GymManager(token_cache=TokenCache(), reference_cache=ReferenceCache())
+# Re-selecting an edited file only validates and builds the rows that changed.
+row_cache = RowCache()
 basedir = os.path.dirname(__file__)
 set_default_color_theme(os.path.join(basedir, "custom.json"))
 
@@ -31,7 +41,11 @@ class App(CTk):
         self.resizable(width=False, height=True)
         self.grid_columnconfigure(2, weight=1)
         self.grid_rowconfigure(12, weight=1)
-        self.console_text = []
+        self.console_text = deque()
+        self.progress_colors = self.generate_colors(101)  # One color per percent.
+        # Built once per run, when the results are first shown.
+        self.results_index = None
+        self.results_window = None
 
         # ---------------------------------- UI GRAPHIC HEADER ---------------------------------- #
 
@@ -195,6 +209,61 @@ class App(CTk):
         )
         self.progressbar.set(0)
 
+        self.button_pause = CTkButton(
+            self.frame_upload,
+            text="Pause",
+            state="disabled",
+            command=self.toggle_pause,
+            width=70,
+        )
+        self.button_pause.grid(
+            column=2,
+            row=10,
+            padx=UNIVERSAL_X_PADDING,
+            pady=(0, 15),
+            sticky="w",
+        )
+
+        self.button_cancel = CTkButton(
+            self.frame_upload,
+            text="Cancel",
+            state="disabled",
+            command=self.cancel_upload,
+            width=70,
+        )
+        self.button_cancel.grid(
+            column=2,
+            row=10,
+            padx=(UNIVERSAL_X_PADDING + 75, UNIVERSAL_X_PADDING),
+            pady=(0, 15),
+            sticky="w",
+        )
+
+        self.button_replay = CTkButton(
+            self.frame_upload,
+            text="Replay failures",
+            command=self.replay_failures,
+            width=120,
+        )
+        self.button_replay.grid(
+            column=2,
+            row=10,
+            padx=(UNIVERSAL_X_PADDING + 150, UNIVERSAL_X_PADDING),
+            pady=(0, 15),
+            sticky="w",
+        )
+
+        self.checkbox_reconcile = CTkCheckBox(
+            self.frame_upload, text="Reconcile after upload"
+        )
+        self.checkbox_reconcile.grid(
+            column=2,
+            row=10,
+            padx=(UNIVERSAL_X_PADDING + 280, UNIVERSAL_X_PADDING),
+            pady=(0, 15),
+            sticky="w",
+        )
+
         # ---------------------------------- UI CONSOLE ---------------------------------- #
 
         self.label_console = CTkLabel(self, text="CONSOLE", font=("Roboto", 12, "bold"))
@@ -222,6 +291,17 @@ class App(CTk):
             sticky="se",
         )
 
+        self.button_show_results = CTkButton(
+            self, text="Show results", command=self.show_results, state="disabled"
+        )
+        self.button_show_results.grid(
+            column=2,
+            row=13,
+            padx=(UNIVERSAL_X_PADDING, 325),
+            pady=(5, 10),
+            sticky="se",
+        )
+
         self.button_clear_console = CTkButton(
             self, text="Clear console", command=self.clear_console
         )
@@ -277,13 +357,30 @@ class App(CTk):
                     f"Login succeeded: User {self.entry_username.get()} logged in."
                 )
                 self.update_console(f"Connection test: {api.connection_test()}")
+                try:
+                    reference = api.reference_data()
+                except Exception as error_message:
+                    self.update_console(
+                        f"Reference data unavailable, IDs are only checked for format: {error_message}"
+                    )
+                else:
+                    self.update_console(
+                        "Reference data loaded: "
+                        + ", ".join(
+                            f"{len(ids)} {kind}" for kind, ids in reference.items()
+                        )
+                    )
 
     def update_console(self, input_string) -> None:
-        self.console_text.append(
-            f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | {input_string}\n"
-        )
-        self.text_box.delete(0.0, END)
-        self.text_box.insert(0.0, "".join(self.console_text))
+        """Appends a line to the console. Only the last CONSOLE_MAX_ENTRIES entries are kept."""
+        entry = f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | {input_string}\n"
+        self.console_text.append(entry)
+        self.text_box.insert(END, entry)
+
+        if len(self.console_text) > CONSOLE_MAX_ENTRIES:
+            line_count = self.console_text.popleft().count("\n")
+            self.text_box.delete("1.0", f"{line_count + 1}.0")
+
         self.text_box.see(END)
 
     def clear_console(self) -> None:
@@ -292,14 +389,13 @@ class App(CTk):
 
     def save_report(self):
         try:
-            file = fd.asksaveasfile(
+            filename = fd.asksaveasfilename(
                 initialfile="report.csv",
                 title="Save report",
                 defaultextension=".csv",
                 filetypes=((("csv files", "*.csv"), ("All files", "*.*"))),
             )
-            file.write(api.report_export)
-            file.close()
+            api.save_report(path=filename)
         except:
             self.update_console(
                 "An error occured when saving the report. Please retry."
@@ -307,16 +403,37 @@ class App(CTk):
         else:
             self.update_console("Report was successfully saved.")
 
+    def show_results(self):
+        """Opens the results of the last run in a table that only renders the visible rows."""
+        if self.results_index is None:
+            self.results_index = ResultsIndex(api.responses)
+        if self.results_window is not None and self.results_window.winfo_exists():
+            self.results_window.destroy()
+        self.results_window = ResultsWindow(self, self.results_index)
+        self.results_window.focus()
+
     def select_file(self):
         filename = fd.askopenfilename(
-            filetypes=((("csv files", "*.csv"), ("All files", "*.*")))
+            filetypes=(
+                ("csv files", "*.csv"),
+                ("Parquet/Feather files", "*.parquet *.feather *.arrow"),
+                ("All files", "*.*"),
+            )
         )
         self.update_console(f"File selected: {filename}")
+        self.filename = filename
 
         if self.checkbox_validate.get() == 1:
-            transform_data = TransformData(filepath=filename, validate=True)
+            transform_data = TransformData(
+                filepath=filename,
+                validate=True,
+                reference=api.reference,
+                row_cache=row_cache,
+            )
         else:
-            transform_data = TransformData(filepath=filename, validate=False)
+            transform_data = TransformData(
+                filepath=filename, validate=False, row_cache=row_cache
+            )
 
         try:
             self.data_to_upload = transform_data.Output()
@@ -325,10 +442,44 @@ class App(CTk):
             self.update_console(
                 f"Unexpected input: {error_message}. Import file not correctly formatted."
             )
-        except ValidationFailed as error_message:
-            self.update_console(f"Validation failed\n\n{error_message}")
         else:
-            transform_data.Report()
+            if transform_data.invalid_count:
+                transform_data.ExportViolations(
+                    path=os.path.join(
+                        os.path.dirname(filename), "validation_report.csv"
+                    )
+                )
+                self.update_console(
+                    "All validation errors were saved to validation_report.csv next to the input file."
+                )
+            if self.data_to_upload:
+                self.button_upload.configure(state="normal")
+
+    def replay_failures(self):
+        """Loads the failed rows of a report or dead-letter file as the data to upload."""
+        filename = fd.askopenfilename(
+            filetypes=(
+                ("Reports and dead-letter files", "*.csv *.jsonl"),
+                ("All files", "*.*"),
+            )
+        )
+        if not filename:
+            return
+
+        try:
+            self.data_to_upload = read_failures(filename)
+        except (OSError, ValueError, KeyError, SyntaxError) as error_message:
+            self.update_console(
+                f"Could not read failures from {filename}: {error_message}"
+            )
+            return
+
+        # The journal of the replayed file keeps a second replay from resending rows that succeeded.
+        self.filename = filename
+        self.update_console(
+            f"{len(self.data_to_upload)} failed records loaded from {filename} for replay."
+        )
+        if self.data_to_upload:
             self.button_upload.configure(state="normal")
 
     def interpolate_color(self, start_color, end_color, fraction):
@@ -353,27 +504,106 @@ class App(CTk):
 
     def update_progressbar(self, progress, step, item_count):
         self.progressbar.set(progress)
-        colors = self.generate_colors(item_count)
-        self.progressbar.configure(progress_color=colors[step])
-        self.update_idletasks()
+        self.progressbar.configure(
+            progress_color=self.progress_colors[int(progress * 100)]
+        )
 
     def upload(self):
+        # Nothing that could start a second upload stays enabled while this one runs.
+        self.button_upload.configure(state="disabled")
+        self.button_login.configure(state="disabled")
+        self.button_locate_file.configure(state="disabled")
+        self.button_replay.configure(state="disabled")
+        self.button_show_results.configure(state="disabled")
+        self.button_pause.configure(state="normal", text="Pause")
+        self.button_cancel.configure(state="normal")
+        # Read here, as widgets are only touched on the main thread.
+        self.reconcile_upload = self.checkbox_reconcile.get() == 1
+        api.clear_cancel()
+        self.upload_events = queue.Queue()
+        self.upload_worker = threading.Thread(target=self.run_upload, daemon=True)
+        self.upload_worker.start()
+        self.after(UI_FRAME_INTERVAL, self.process_upload_events)
+
+    def run_upload(self):
+        """Runs the upload on a worker thread. Never touches widgets; all output goes through self.upload_events."""
+        events = self.upload_events
         try:
-            api.post_data(data=self.data_to_upload, callbck=self.update_progressbar)
+            with Journal.for_input(self.filename) as journal:
+                api.post_data(
+                    data=self.data_to_upload,
+                    callbck=lambda **progress: events.put(("progress", progress)),
+                    concurrency=UPLOAD_CONCURRENCY,
+                    journal=journal,
+                )
+            if self.reconcile_upload and not api.cancelled:
+                events.put(("log", "Checking the changed memberships..."))
+                api.reconcile(
+                    sample=RECONCILE_SAMPLE,
+                    concurrency=UPLOAD_CONCURRENCY,
+                    callbck=lambda **progress: events.put(("progress", progress)),
+                )
         except:
-            self.update_console("Undefined error. Please try again.")
+            events.put(("log", "Undefined error. Please try again."))
         else:
-            self.update_console(f"Uploading complete.\n" + api.report())
-            self.button_export_report.configure(state="normal")
-
+            if api.cancelled:
+                events.put(("log", "Upload cancelled."))
+            events.put(("log", f"Uploading complete.\n" + api.report()))
+            events.put(("report", None))
+        events.put(("done", None))
+
+    def process_upload_events(self):
+        """Drains the upload event queue once per frame. Only the latest progress event of a frame is drawn."""
+        progress = None
+        done = False
+
+        while True:
             try:
-                api.export_report()
-            except:
-                self.update_console(
-                    "An error occured when saving the report file. Please try again."
-                )
+                kind, payload = self.upload_events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                progress = payload
+            elif kind == "log":
+                self.update_console(payload)
+            elif kind == "report":
+                self.button_export_report.configure(state="normal")
+                self.button_show_results.configure(state="normal")
+                self.results_index = None
+            elif kind == "done":
+                done = True
+
+        if progress is not None and progress["progress"] is not None:
+            self.update_progressbar(**progress)
+
+        if done:
+            self.button_upload.configure(state="normal")
+            self.button_login.configure(state="normal")
+            self.button_locate_file.configure(state="normal")
+            self.button_replay.configure(state="normal")
+            self.button_pause.configure(state="disabled", text="Pause")
+            self.button_cancel.configure(state="disabled")
+        else:
+            self.after(UI_FRAME_INTERVAL, self.process_upload_events)
+
+    def toggle_pause(self):
+        if api.unpaused.is_set():
+            api.pause()
+            self.button_pause.configure(text="Resume")
+            self.update_console("Upload paused.")
+        else:
+            api.resume()
+            self.button_pause.configure(text="Pause")
+            self.update_console("Upload resumed.")
+
+    def cancel_upload(self):
+        api.cancel()
+        self.button_pause.configure(state="disabled")
+        self.button_cancel.configure(state="disabled")
+        self.update_console("Cancelling upload after the requests in flight...")
 
 
-app = App()
-app.iconbitmap(os.path.join(basedir, "assets/favicon.ico"))
-app.mainloop()
+if __name__ == "__main__":
+    app = App()
+    app.iconbitmap(os.path.join(basedir, "assets/favicon.ico"))
+    app.mainloop()
@@ -0,0 +1,21 @@
+import os
+import tempfile
+
+
+def write_atomic(filepath: str, content: str) -> None:
+    """Replaces `filepath` with `content` in one step. Each writer uses its own temporary file in the same directory, so concurrent processes never clobber or rename each other's file. The file is readable by the current user only."""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(
+        dir=directory, prefix=os.path.basename(filepath) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(descriptor, "w", encoding="utf-8") as temporary_file:
+            temporary_file.write(content)
+        os.replace(temporary_path, filepath)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+        raise
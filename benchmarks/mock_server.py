@@ -0,0 +1,148 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockGymManager(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple = ("127.0.0.1", 0),
+        latency: float = 0.02,
+        jitter: float = 0.01,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+    ):
+        """Stand-in for the Gym Manager API endpoints used by the tool. Latencies are in seconds; rates are fractions of change requests."""
+        super().__init__(address, MockHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        # PeopleMembershipId -> state after the last successful change, served for reconciliation.
+        self.memberships = {}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def start(self) -> "MockGymManager":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real API.
+    # Headers and body are written separately; without this, Nagle's algorithm adds ~40 ms per response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def send_json(self, status_code: int, payload: dict, headers: dict = {}) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status_code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def simulate_latency(self) -> None:
+        server = self.server
+        time.sleep(max(server.latency + random.uniform(-1, 1) * server.jitter, 0))
+
+    def do_GET(self) -> None:
+        self.simulate_latency()
+        if self.path.startswith("/api/v1/Clubs"):
+            self.send_json(
+                200,
+                {
+                    "status": {"success": True, "code": 0, "message": "OK"},
+                    "data": [{"id": "00000000-0000-0000-0000-000000000001"}],
+                },
+            )
+        elif self.path.startswith("/api/v1/PeopleMemberships/"):
+            state = self.server.memberships.get(self.path.rsplit("/", 1)[-1])
+            if state is None:
+                self.send_json(
+                    404, {"status": {"success": False, "message": "Not found"}}
+                )
+            else:
+                self.send_json(
+                    200,
+                    {"status": {"success": True, "message": "OK"}, "data": state},
+                )
+        else:
+            self.send_json(404, {"status": {"success": False, "message": "Not found"}})
+
+    def do_POST(self) -> None:
+        body = self.read_body()
+        self.simulate_latency()
+        server = self.server
+
+        if self.path == "/api/v1/Authorize/AuthenticateJson":
+            self.send_json(
+                200,
+                {
+                    "status": {"success": True, "code": 0, "message": "OK"},
+                    "data": "Bearer benchmark-token",
+                },
+            )
+        elif self.path.startswith("/api/v1/PeopleMemberships/PeopleMembershipChange/"):
+            draw = random.random()
+            if draw < server.throttle_rate:
+                self.send_json(
+                    429,
+                    {"status": {"success": False, "message": "Too many requests"}},
+                    {"Retry-After": str(server.retry_after)},
+                )
+            elif draw < server.throttle_rate + server.error_rate:
+                self.send_json(
+                    500, {"status": {"success": False, "message": "Internal error"}}
+                )
+            else:
+                membership_id, payment_schedule_id = self.path.split("?")[0].split("/")[
+                    -2:
+                ]
+                server.memberships[membership_id] = {
+                    "id": membership_id,
+                    "paymentScheduleId": payment_schedule_id,
+                    "articles": json.loads(body or b"{}").get("articles", []),
+                }
+                self.send_json(
+                    200, {"status": {"success": True, "message": "Membership changed"}}
+                )
+        else:
+            self.send_json(404, {"status": {"success": False, "message": "Not found"}})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the mock Gym Manager API.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockGymManager(
+        ("127.0.0.1", args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+    )
+    print(f"Mock Gym Manager API listening on {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,203 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from mock_server import MockGymManager
+
+DATA_DIR = os.path.join(BENCHMARK_DIR, "data")
+RESULTS_FILE = os.path.join(BENCHMARK_DIR, "results.jsonl")
+HEADER = "peopleMembershipId;paymentScheduleId;promotionId;referenceDate;article_id_1;article_id_2;article_id_3;article_id_4;article_id_5\n"
+
+
+def generate_input(rows: int) -> str:
+    """Writes a synthetic input CSV with `rows` valid records, reusing an earlier one if present."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    filepath = os.path.join(DATA_DIR, f"input_{rows}.csv")
+    if os.path.exists(filepath):
+        return filepath
+
+    new_id = lambda: str(uuid.uuid4()).upper()
+    with open(filepath + ".tmp", "w") as input_file:
+        input_file.write(HEADER)
+        for i in range(rows):
+            # Mix of rows with and without promotion and with 0-4 articles, like real exports.
+            promotion = new_id() if i % 3 == 0 else ""
+            articles = [new_id() if n < i % 5 else "" for n in range(5)]
+            input_file.write(
+                ";".join(
+                    [new_id(), new_id(), promotion, "2024-01-01T00:00:00.000"]
+                    + articles
+                )
+                + "\n"
+            )
+    os.replace(filepath + ".tmp", filepath)
+    return filepath
+
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    if len(samples) == 1:
+        return {"p50": samples[0], "p95": samples[0], "p99": samples[0]}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def transform_phase(filepath: str, repeat: int) -> dict:
+    """Times TransformData.Output end to end. Latency percentiles are over the repeated runs."""
+    from data import TransformData
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        records = TransformData(filepath=filepath).Output()
+        durations.append(time.perf_counter() - start)
+
+    return {
+        "rows": len(records),
+        "rows_per_sec": round(len(records) / statistics.median(durations), 1),
+        "latency_s": percentiles(durations),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def upload_phase(filepath: str, base_url: str, concurrency: int) -> dict:
+    """Times GymManager.post_data against the mock server. Latency percentiles are per row."""
+    from api import GymManager
+    from data import TransformData
+    from reference import ReferenceCache
+
+    latencies = []
+
+    class TimedGymManager(GymManager):
+        def _post_row(self, row):
+            start = time.perf_counter()
+            try:
+                return super()._post_row(row)
+            finally:
+                latencies.append(time.perf_counter() - start)
+
+    records = TransformData(filepath=filepath, base_url=base_url).Output()
+    report_path = os.path.join(DATA_DIR, "report.csv")
+
+    # Never touch the user's token and reference caches in ~/.gm-api-tool.
+    with tempfile.TemporaryDirectory() as cache_dir, contextlib.redirect_stdout(
+        io.StringIO()
+    ):
+        api = TimedGymManager(
+            base_url=base_url,
+            pool_size=concurrency,
+            rate_limit=1000,
+            token_cache=None,
+            reference_cache=ReferenceCache(os.path.join(cache_dir, "reference.json")),
+        )
+        api.authenticate(user_name="benchmark", password="benchmark")
+        start = time.perf_counter()
+        api.post_data(data=records, concurrency=concurrency, report_path=report_path)
+        duration = time.perf_counter() - start
+
+    return {
+        "rows": len(records),
+        "rows_per_sec": round(len(records) / duration, 1),
+        "latency_s": percentiles(latencies),
+        "failed_rows": api.failures,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _child(result_queue, phase, kwargs) -> None:
+    result_queue.put(phase(**kwargs))
+
+
+def run_isolated(phase, **kwargs) -> dict:
+    """Runs a phase in a fresh process, so its peak RSS is not mixed with other phases."""
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    process = context.Process(target=_child, args=(result_queue, phase, kwargs))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark TransformData.Output and GymManager.post_data against a local mock Gym Manager API."
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000]
+    )
+    parser.add_argument(
+        "--upload-sizes",
+        type=int,
+        nargs="+",
+        default=[1_000],
+        help="Input sizes to upload; uploads are bound by mock latency, so keep these small.",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    run = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": vars(args),
+        "transform": {},
+        "upload": {},
+    }
+
+    for rows in args.sizes:
+        filepath = generate_input(rows)
+        run["transform"][rows] = result = run_isolated(
+            transform_phase, filepath=filepath, repeat=args.repeat
+        )
+        print(f"transform {rows:>9} rows: {json.dumps(result)}")
+
+    server = MockGymManager(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+    ).start()
+    for rows in args.upload_sizes:
+        filepath = generate_input(rows)
+        run["upload"][rows] = result = run_isolated(
+            upload_phase,
+            filepath=filepath,
+            base_url=server.base_url,
+            concurrency=args.concurrency,
+        )
+        print(f"upload    {rows:>9} rows: {json.dumps(result)}")
+    server.shutdown()
+
+    with open(RESULTS_FILE, "a") as results_file:
+        results_file.write(json.dumps(run) + "\n")
+    print(f"Results appended to {RESULTS_FILE}")
+
+
+if __name__ == "__main__":
+    main()
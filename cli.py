@@ -0,0 +1,467 @@
+import argparse
+import getpass
+import os
+import sys
+from contextlib import nullcontext
+from constants import BASE_URL
+
+
+def credentials(args: argparse.Namespace) -> tuple:
+    user_name = args.username or os.environ.get("GM_USERNAME", "")
+    password = os.environ.get("GM_PASSWORD") or getpass.getpass("Password: ")
+    return user_name, password
+
+
+def gym_manager(base_url: str, concurrency: int) -> object:
+    """Returns a client that caches its token and reference data in ~/.gm-api-tool, with a connection for every request in flight."""
+    from api import POOL_SIZE, GymManager
+    from reference import ReferenceCache
+    from token_cache import TokenCache
+
+    return GymManager(
+        base_url=base_url,
+        pool_size=max(concurrency, POOL_SIZE),
+        token_cache=TokenCache(),
+        reference_cache=ReferenceCache(),
+    )
+
+
+def upload(args: argparse.Namespace) -> int:
+    """Validates, transforms and uploads one input file without the GUI."""
+    # Imported here, so `--help` and argument errors never pay for requests/pandas.
+    from api import ConnectionFailed
+    from data import TransformData
+    from journal import Journal
+    from row_cache import RowCache
+
+    user_name, password = credentials(args)
+
+    api = gym_manager(base_url=args.base_url, concurrency=args.concurrency)
+    try:
+        api.authenticate(user_name=user_name, password=password)
+        print(f"Connection test: {api.connection_test()}")
+    except ConnectionFailed as error_message:
+        print(f"Failed to log in: {error_message}", file=sys.stderr)
+        return 2
+
+    reference = None
+    if args.validate and args.reference_check:
+        reference = api.reference_data(refresh=args.refresh_reference)
+
+    transform_data = TransformData(
+        filepath=args.file,
+        validate=args.validate,
+        chunksize=args.chunksize,
+        base_url=args.base_url,
+        reference=reference,
+        row_cache=RowCache() if args.row_cache else None,
+    )
+
+    try:
+        if args.chunksize:
+            # Streaming starts posting straight away; invalid rows are skipped chunk by chunk, so the expected count shrinks as they are found.
+            row_count = transform_data.RowCount()
+            data = transform_data.Stream()
+            item_count = lambda: row_count - transform_data.invalid_count
+        else:
+            data = transform_data.Output()
+            item_count = len(data)
+            print(transform_data.Report())
+
+        with Journal.for_input(args.file) if args.journal else nullcontext() as journal:
+            api.post_data(
+                data=data,
+                concurrency=args.concurrency,
+                item_count=item_count,
+                journal=journal,
+                report_path=args.report,
+                dead_letter_path=args.dead_letter,
+            )
+    except AttributeError as error_message:
+        print(
+            f"Unexpected input: {error_message}. Import file not correctly formatted.",
+            file=sys.stderr,
+        )
+        return 2
+
+    if transform_data.invalid_count:
+        transform_data.ExportViolations(path=args.validation_report)
+        print(
+            f"{transform_data.invalid_count} invalid records were skipped; see {args.validation_report}.",
+            file=sys.stderr,
+        )
+
+    if args.reconcile and not api.cancelled:
+        api.reconcile(sample=args.reconcile_sample, concurrency=args.concurrency)
+
+    print(api.report())
+    if args.metrics:
+        api.metrics.write(path=args.metrics)
+    unreconciled = (api.reconciled or {}).keys() - {"verified"}
+    return 1 if api.failures or transform_data.invalid_count or unreconciled else 0
+
+
+def replay(args: argparse.Namespace) -> int:
+    """Re-submits only the failed rows of a report or dead-letter file."""
+    from api import ConnectionFailed
+    from journal import Journal
+    from report import read_failures
+
+    rows = read_failures(args.file)
+    if not rows:
+        print(f"No failed rows in {args.file}.")
+        return 0
+
+    user_name, password = credentials(args)
+    api = gym_manager(base_url=args.base_url, concurrency=args.concurrency)
+    try:
+        api.authenticate(user_name=user_name, password=password)
+    except ConnectionFailed as error_message:
+        print(f"Failed to log in: {error_message}", file=sys.stderr)
+        return 2
+
+    print(f"Replaying {len(rows)} failed rows from {args.file}.")
+    # A journal per replayed file, so replaying the same file twice does not resend rows that succeeded.
+    with Journal.for_input(args.file) as journal:
+        api.post_data(
+            data=rows,
+            concurrency=args.concurrency,
+            journal=journal,
+            report_path=args.report,
+            dead_letter_path=args.dead_letter,
+        )
+
+    print(api.report())
+    return 1 if api.dead_letters else 0
+
+
+def watch(args: argparse.Namespace) -> int:
+    """Uploads new files dropped into a directory until interrupted."""
+    import signal
+    from api import ConnectionFailed
+    from row_cache import RowCache
+    from watch import Watcher
+
+    user_name, password = credentials(args)
+    api = gym_manager(base_url=args.base_url, concurrency=args.concurrency)
+    try:
+        api.authenticate(user_name=user_name, password=password)
+        print(f"Connection test: {api.connection_test()}")
+    except ConnectionFailed as error_message:
+        print(f"Failed to log in: {error_message}", file=sys.stderr)
+        return 2
+
+    watcher = Watcher(
+        directory=args.directory,
+        api=api,
+        validate=args.validate,
+        reference_check=args.reference_check,
+        concurrency=args.concurrency,
+        interval=args.interval,
+        settle=args.settle,
+        row_cache=RowCache() if args.row_cache else None,
+    )
+    signal.signal(signal.SIGTERM, lambda *_: watcher.stop())
+    try:
+        watcher.run(once=args.once)
+    except KeyboardInterrupt:
+        watcher.stop()
+    return 0
+
+
+def shard_split(args: argparse.Namespace) -> int:
+    import shard
+
+    shard.split(filepath=args.file, shard_dir=args.dir, shards=args.shards)
+    print(f"Split {args.file} into {args.shards} shards in {args.dir}.")
+    return 0
+
+
+def shard_work(args: argparse.Namespace) -> int:
+    import shard
+
+    user_name, password = credentials(args)
+    print(
+        shard.work(
+            shard_dir=args.dir,
+            shard=args.shard,
+            user_name=user_name,
+            password=password,
+            concurrency=args.concurrency,
+            validate=args.validate,
+            base_url=args.base_url,
+        )
+    )
+    return 0
+
+
+def shard_merge(args: argparse.Namespace) -> int:
+    import shard
+
+    try:
+        rows = shard.merge(shard_dir=args.dir, report_path=args.report)
+    except FileNotFoundError as error_message:
+        print(error_message, file=sys.stderr)
+        return 2
+    print(f"Merged {rows} rows into {args.report}.")
+    return 0
+
+
+def shard_run(args: argparse.Namespace) -> int:
+    import shard
+
+    user_name, password = credentials(args)
+    rows = shard.run(
+        filepath=args.file,
+        shards=args.shards,
+        user_name=user_name,
+        password=password,
+        shard_dir=args.dir,
+        concurrency=args.concurrency,
+        validate=args.validate,
+        base_url=args.base_url,
+        report_path=args.report,
+    )
+    print(f"Merged {rows} rows into {args.report}.")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Communicate membership changes to Gym Manager without the GUI.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    upload_parser = commands.add_parser(
+        "upload",
+        help="Upload a membership change file.",
+        description="Credentials are read from --username/GM_USERNAME and GM_PASSWORD. The password is prompted for when GM_PASSWORD is not set.",
+    )
+    upload_parser.add_argument("file", help="Input CSV (semicolon separated).")
+    upload_parser.add_argument(
+        "--validate",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Validate input against business ruling (default: on).",
+    )
+    upload_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of requests in flight (default: 8).",
+    )
+    upload_parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help="Stream the file in chunks of this many rows instead of loading it whole.",
+    )
+    upload_parser.add_argument(
+        "--report", default="report.csv", help="Report path (default: report.csv)."
+    )
+    upload_parser.add_argument(
+        "--reference-check",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Check IDs against cached Gym Manager reference data before sending (default: on).",
+    )
+    upload_parser.add_argument(
+        "--refresh-reference",
+        action="store_true",
+        help="Fetch reference data even if the cached copy is still fresh.",
+    )
+    upload_parser.add_argument(
+        "--validation-report",
+        default="validation_report.csv",
+        help="Where to write validation errors of skipped rows (default: validation_report.csv).",
+    )
+    upload_parser.add_argument(
+        "--journal",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Skip rows that already succeeded in an earlier run (default: on).",
+    )
+    upload_parser.add_argument(
+        "--row-cache",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Reuse validation results and API calls of rows seen in earlier runs (default: off).",
+    )
+    upload_parser.add_argument(
+        "--metrics",
+        default=None,
+        help="Write request metrics to this path: Prometheus text for .prom/.txt, JSON otherwise.",
+    )
+    upload_parser.add_argument(
+        "--dead-letter",
+        default=None,
+        help="Where to write rows that still failed after retries (default: next to the report, as .dead_letter.jsonl).",
+    )
+    upload_parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="After the upload, fetch the changed memberships and check they hold the uploaded payment schedule and articles. Not available with --chunksize, as streamed uploads keep no results in memory.",
+    )
+    upload_parser.add_argument(
+        "--reconcile-sample",
+        type=int,
+        default=None,
+        help="Reconcile only this many randomly picked memberships (default: all).",
+    )
+    upload_parser.add_argument("--username", default=None)
+    upload_parser.add_argument(
+        "--base-url",
+        default=BASE_URL,
+        help="Gym Manager API root, e.g. a test environment or the benchmark mock server.",
+    )
+    upload_parser.set_defaults(func=upload)
+
+    replay_parser = commands.add_parser(
+        "replay",
+        help="Re-submit the failed rows of a report or dead-letter file.",
+        description="Reads report.csv, a JSONL report or a .dead_letter.jsonl file and uploads only the rows that did not succeed.",
+    )
+    replay_parser.add_argument("file", help="Report or dead-letter file.")
+    replay_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of requests in flight (default: 8).",
+    )
+    replay_parser.add_argument(
+        "--report",
+        default="replay_report.csv",
+        help="Report path (default: replay_report.csv).",
+    )
+    replay_parser.add_argument(
+        "--dead-letter",
+        default=None,
+        help="Where to write rows that failed again (default: next to the report).",
+    )
+    replay_parser.add_argument("--username", default=None)
+    replay_parser.add_argument("--base-url", default=BASE_URL)
+    replay_parser.set_defaults(func=replay)
+
+    watch_parser = commands.add_parser(
+        "watch",
+        help="Upload new files dropped into a directory, as a long-running service.",
+        description="Logs in once and uploads every new or changed CSV/Parquet/Feather file in the directory. "
+        "Reports are written next to each input as <file>.report.csv; processed files are tracked in .gm-watch.json.",
+    )
+    watch_parser.add_argument("directory", help="Directory to watch.")
+    watch_parser.add_argument(
+        "--interval",
+        type=float,
+        default=5,
+        help="Seconds between directory scans (default: 5).",
+    )
+    watch_parser.add_argument(
+        "--settle",
+        type=float,
+        default=10,
+        help="Seconds a file must stay unchanged before it is picked up (default: 10).",
+    )
+    watch_parser.add_argument(
+        "--row-cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Only validate and build the changed rows of a file dropped in again (default: on).",
+    )
+    watch_parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Process the files present now and exit, e.g. from a scheduled job.",
+    )
+    watch_parser.add_argument(
+        "--validate",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Validate input against business ruling (default: on).",
+    )
+    watch_parser.add_argument(
+        "--reference-check",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Check IDs against Gym Manager reference data before sending (default: on).",
+    )
+    watch_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of requests in flight (default: 8).",
+    )
+    watch_parser.add_argument("--username", default=None)
+    watch_parser.add_argument("--base-url", default=BASE_URL)
+    watch_parser.set_defaults(func=watch)
+
+    shard_parser = commands.add_parser(
+        "shard",
+        help="Split a file into shards and upload them from several processes or machines.",
+        description="Rows are assigned to shards by a stable hash of peopleMembershipId, so all changes to one membership stay in one shard and in input order. "
+        "Run `work` once per shard, on any machine that shares the shard directory, then `merge`. `run` does all three locally.",
+    )
+    shard_commands = shard_parser.add_subparsers(dest="shard_command", required=True)
+
+    split_parser = shard_commands.add_parser("split", help="Split an input file.")
+    split_parser.add_argument("file", help="Input CSV (semicolon separated).")
+    split_parser.add_argument("--shards", type=int, required=True)
+    split_parser.add_argument("--dir", required=True, help="Shared shard directory.")
+    split_parser.set_defaults(func=shard_split)
+
+    work_parser = shard_commands.add_parser("work", help="Upload one shard.")
+    work_parser.add_argument("dir", help="Shared shard directory.")
+    work_parser.add_argument("--shard", type=int, required=True)
+    work_parser.set_defaults(func=shard_work)
+
+    merge_parser = shard_commands.add_parser(
+        "merge", help="Merge the shard reports in input order."
+    )
+    merge_parser.add_argument("dir", help="Shared shard directory.")
+    merge_parser.add_argument(
+        "--report", default="report.csv", help="Report path (default: report.csv)."
+    )
+    merge_parser.set_defaults(func=shard_merge)
+
+    run_parser = shard_commands.add_parser(
+        "run", help="Split, upload every shard in a local process, and merge."
+    )
+    run_parser.add_argument("file", help="Input CSV (semicolon separated).")
+    run_parser.add_argument("--shards", type=int, default=os.cpu_count())
+    run_parser.add_argument(
+        "--dir", default=None, help="Shard directory (default: <file>.shards)."
+    )
+    run_parser.add_argument(
+        "--report", default="report.csv", help="Report path (default: report.csv)."
+    )
+    run_parser.set_defaults(func=shard_run)
+
+    for parser_ in (work_parser, run_parser):
+        parser_.add_argument(
+            "--validate",
+            action=argparse.BooleanOptionalAction,
+            default=True,
+            help="Validate input against business ruling (default: on).",
+        )
+        parser_.add_argument(
+            "--concurrency",
+            type=int,
+            default=8,
+            help="Maximum number of requests in flight per shard (default: 8).",
+        )
+        parser_.add_argument("--username", default=None)
+        parser_.add_argument("--base-url", default=BASE_URL)
+
+    return parser
+
+
+def main(argv: list = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "reconcile", False) and args.chunksize:
+        parser.error("--reconcile cannot be combined with --chunksize")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,2 +1,7 @@
+BASE_URL = "https://trainmore-apiv6.gymmanager.eu/api/v1"
 UNIVERSAL_PADDING = 5
-UNIVERSAL_X_PADDING = 15
\ No newline at end of file
+UNIVERSAL_X_PADDING = 15
+UPLOAD_CONCURRENCY = 8
+UI_FRAME_INTERVAL = 33  # Milliseconds between GUI refreshes during an upload.
+CONSOLE_MAX_ENTRIES = 1000
+RECONCILE_SAMPLE = 10_000  # Memberships checked after a GUI upload.
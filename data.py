@@ -1,119 +1,363 @@
+import numpy as np
 import pandas as pd
-import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator
+from constants import BASE_URL
+from fast_json import dumps, loads
+import ingest
+from ingest import INPUT_COLUMNS
+from row_cache import RowCache, row_hashes
 
 
-class ValidationFailed(Exception):
-    pass
+CHANGE_PATH = "/PeopleMemberships/PeopleMembershipChange/"
+ARTICLE_COLUMNS = [f"article_id_{n}" for n in range(1, 6)]
+REQUIRED_COLUMNS = ["peopleMembershipId", "paymentScheduleId", "referenceDate"]
+ID_COLUMNS = ["peopleMembershipId", "paymentScheduleId", "promotionId"]
+ID_PATTERN = "[0-9A-Z]{8}-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{12}"
+TIMESTAMP_PATTERN = r"\d{4}-\d{2}-\d{2}T00:00:00\.000"
+PARALLEL_VALIDATION_ROWS = 500_000  # Larger frames are validated on a process pool.
+VIOLATION_COLUMNS = ["row", "column", "value", "reason", "severity"]
+# Rows with errors are skipped. Warnings are reported, but the row is uploaded.
+ERROR = "error"
+WARNING = "warning"
+REFERENCE_COLUMNS = {
+    "paymentScheduleId": "paymentSchedules",
+    "promotionId": "promotions",
+    **{column: "articles" for column in ARTICLE_COLUMNS},
+}
 
 
-class TransformData:
-    def __init__(self, filepath: str, validate: bool = True) -> list:
-        """Sets up the initial DataFrame from input CSV. Validates all input data against business ruling unless optional parameter validate is set to False."""
-        self.filepath = filepath
-        self.df = pd.pandas.read_csv(self.filepath, delimiter=";")
-        self.df = self.df.applymap(
-            lambda x: x.strip() if isinstance(x, str) else x  # Strip any whitespaces.
-        )
-        self.validate = validate
-        self.new_data = []
+def mismatch(values: object, pattern: str) -> object:
+    """Returns a boolean mask of filled cells that do not fully match `pattern`."""
+    return values.notna() & ~values.astype(object).str.fullmatch(pattern).eq(True)
 
-    def IdCheck(self, id: str, row: object, index: int) -> str:
-        """Validates IDs against business ruling using regex."""
-        if not self.validate:
-            return
-        pattern = re.compile(
-            "^[0-9A-Z]{8}-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{4}-[0-9A-Z]{12}$"
-        )
 
-        if pattern.match(id) is None:
-            raise ValidationFailed(
-                f"One of your IDs failed regex validation. Make sure to follow this format (36 chars) and use A-Z or 0-9 characters: XXXXXXXX-XXXX-XXXX-XXXX-XXXXXXXXXXXX.\n\nConflicting record (row {index + 2}):\n\n{row}."
+def find_violations(dataframe: object, reference: dict = None) -> object:
+    """Checks whole columns against business ruling, and IDs against the known IDs in `reference` when given. Returns one row per violation (file row, column, value, reason, severity), indexed by the offending DataFrame row. IDs missing from the reference data are only warnings, as the reference lists may be incomplete (e.g. paginated or active-only)."""
+    violations = []
+
+    def collect(column: str, mask: object, reason: str, severity: str = ERROR) -> None:
+        if mask.any():
+            found = pd.DataFrame(
+                {
+                    "column": column,
+                    "value": dataframe[column][mask],
+                    "reason": reason,
+                    "severity": severity,
+                }
             )
+            violations.append(found)
 
-    def TimeStampCheck(self, timestamp: str, row: object, index: int) -> str:
-        """Validates timestamps against business ruling using regex."""
-        pattern = re.compile("^\d{4}-\d{2}-\d{2}T00:00:00\.000$")
+    for column in REQUIRED_COLUMNS:
+        collect(column, getattr(dataframe, column).isna(), "missing required field")
+
+    for column in ID_COLUMNS + ARTICLE_COLUMNS:
+        collect(
+            column,
+            mismatch(getattr(dataframe, column), ID_PATTERN),
+            "invalid ID, expected XXXXXXXX-XXXX-XXXX-XXXX-XXXXXXXXXXXX (A-Z, 0-9)",
+        )
 
-        if pattern.match(timestamp) is None:
-            raise ValidationFailed(
-                f"One of your timestamps failed regex validation. Make sure to follow the format below (23 chars) and always use a time value of T00:00:00.000:\nYYYY-MM-DDT00:00:00.000.\n\nConflicting record (row {index + 2}):\n\n{row}."
+    collect(
+        "referenceDate",
+        mismatch(dataframe.referenceDate, TIMESTAMP_PATTERN),
+        "invalid referenceDate, expected YYYY-MM-DDT00:00:00.000",
+    )
+
+    for column, kind in REFERENCE_COLUMNS.items():
+        if reference and kind in reference:
+            values = getattr(dataframe, column)
+            # Malformed IDs are already reported above; only well-formed unknown IDs are added here.
+            collect(
+                column,
+                values.astype(object).str.fullmatch(ID_PATTERN).eq(True)
+                & ~values.isin(reference[kind]),
+                f"unknown {column}, not found in Gym Manager reference data",
+                WARNING,
             )
 
-    def DataFrameValidation(self, dataframe: object) -> str:
-        """Validates DataFrame against business ruling. Checks for empty mandatory fields."""
-        if not self.validate:
-            return
-        if (
-            dataframe.peopleMembershipId.isnull().values.any()
-            or dataframe.paymentScheduleId.isnull().values.any()
-            or dataframe.referenceDate.isnull().values.any()
-        ):
-            raise ValidationFailed(
-                f"One of your records is missing a required field. Please correct your input.\n\nMandatory fields:\n\npeopleMembershipId\npaymentScheduleID\nreferenceDate"
+    if not violations:
+        return pd.DataFrame(columns=VIOLATION_COLUMNS)
+
+    result = pd.concat(violations)
+    result.insert(0, "row", result.index + 2)  # Header is row 1 of the file.
+    return result.sort_values("row", kind="stable")
+
+
+class TransformData:
+    def __init__(
+        self,
+        filepath: str,
+        validate: bool = True,
+        chunksize: int = None,
+        base_url: str = BASE_URL,
+        reference: dict = None,
+        row_cache: RowCache = None,
+    ) -> list:
+        """Sets up the initial DataFrame from input CSV, Parquet or Arrow IPC/Feather. Validates all input data against business ruling unless optional parameter validate is set to False. With a chunksize, the file is read lazily by Stream()."""
+        self.filepath = filepath
+        self.chunksize = chunksize
+        self.change_url = base_url + CHANGE_PATH
+        # Known IDs per kind, see GymManager.reference_data().
+        self.reference = reference
+        self.df = None
+        if chunksize is None:
+            self.df = ingest.read(self.filepath)
+        self.validate = validate
+        self.new_data = []
+        self.record_count = 0
+        self.violations = []
+        self.invalid_count = 0
+        self.warning_count = 0
+        # Validation results and API calls per row content, see row_cache.py.
+        self.row_cache = row_cache
+        if row_cache is not None:
+            self.cache_namespace = RowCache.namespace(
+                validate=validate, change_url=self.change_url, reference=reference
             )
 
-    def RowValidation(self, row: object, index: int) -> str:
-        """Validates rows against business ruling. Checks if IDs and referenceDate are valid."""
-        if not self.validate:
-            return
-        self.IdCheck(id=row.peopleMembershipId, row=row, index=index)
+    def RowCount(self) -> int:
+        """Counts data rows without parsing the file."""
+        return ingest.row_count(self.filepath)
+
+    def Validate(self, dataframe: object) -> object:
+        """Collects every violation in the DataFrame at once. Very large frames are split across a process pool."""
+        if len(dataframe) < PARALLEL_VALIDATION_ROWS:
+            return find_violations(dataframe, reference=self.reference)
 
-        self.IdCheck(id=row.paymentScheduleId, row=row, index=index)
+        chunks = [
+            dataframe.iloc[start : start + PARALLEL_VALIDATION_ROWS]
+            for start in range(0, len(dataframe), PARALLEL_VALIDATION_ROWS)
+        ]
+        with ProcessPoolExecutor() as executor:
+            return pd.concat(
+                list(
+                    executor.map(
+                        partial(find_violations, reference=self.reference), chunks
+                    )
+                )
+            )
 
-        if pd.notna(row.promotionId):
-            self.IdCheck(id=row.promotionId, row=row, index=index)
+    def Violations(self) -> object:
+        """Returns all violations found so far as one DataFrame with row number, column, value and reason."""
+        if not self.violations:
+            return pd.DataFrame(columns=VIOLATION_COLUMNS)
+        return pd.concat(self.violations)
 
-        self.TimeStampCheck(timestamp=row.referenceDate, row=row, index=index)
+    def ExportViolations(self, path: str = "validation_report.csv") -> None:
+        self.Violations().to_csv(path, sep=";", index=False)
 
     def Output(self) -> list[dict]:
         """Transforms DataFrame to API calls."""
+        self.new_data.extend(self.Transform(dataframe=self.df))
+        self.record_count = len(self.new_data)
 
-        self.DataFrameValidation(dataframe=self.df)
+        return self.new_data
 
-        for i, row in self.df.iterrows():
-            self.RowValidation(row=row, index=i)
+    def Stream(self) -> Iterator[dict]:
+        """Yields API calls while reading the input file in chunks of `chunksize` rows. Each chunk is validated before its records are yielded."""
+        for chunk in ingest.read_chunks(self.filepath, self.chunksize or 10_000):
+            for record in self.Transform(dataframe=chunk):
+                self.record_count += 1
+                yield record
 
-            if pd.notna(row.promotionId):
-                url = f"https://trainmore-apiv6.gymmanager.eu/api/v1/PeopleMemberships/PeopleMembershipChange/{row.peopleMembershipId}/{row.paymentScheduleId}?referenceDate={row.referenceDate}&promotionId={row.promotionId}"
-            else:
-                url = f"https://trainmore-apiv6.gymmanager.eu/api/v1/PeopleMemberships/PeopleMembershipChange/{row.peopleMembershipId}/{row.paymentScheduleId}?referenceDate={row.referenceDate}"
+    def Transform(self, dataframe: object) -> list[dict]:
+        """Validates a DataFrame and transforms its valid rows to API calls. With a row cache, only rows not seen before are validated and built."""
+        if self.row_cache is None:
+            violations, invalid = self.Check(dataframe=dataframe)
+            records = self.Build(dataframe=dataframe[~invalid])
+        else:
+            violations, records = self.CachedTransform(dataframe=dataframe)
 
-            article_ids = []
-            body = {}
+        if len(violations):
+            # Invalid rows are reported and left out; the valid rows continue to upload.
+            self.violations.append(violations)
+            invalid = violations.index[violations.severity == ERROR].unique()
+            self.invalid_count += len(invalid)
+            # Only rows that are still uploaded count as warnings.
+            self.warning_count += violations.index.unique().difference(invalid).size
+        return records
+
+    def Check(self, dataframe: object) -> tuple:
+        """Returns the violations of a DataFrame and a boolean mask of its invalid rows (rows with errors)."""
+        if not self.validate:
+            return pd.DataFrame(columns=VIOLATION_COLUMNS), np.zeros(
+                len(dataframe), dtype=bool
+            )
+        violations = self.Validate(dataframe=dataframe)
+        return violations, dataframe.index.isin(
+            violations.index[violations.severity == ERROR]
+        )
 
-            if pd.notna(row.article_id_1):
-                article_ids.append(row.article_id_1)
+    def CachedTransform(self, dataframe: object) -> tuple:
+        """Takes the validation result and API call of unchanged rows from the row cache; only the other rows are validated and built, and then cached. Returns (violations, records)."""
+        keys = row_hashes(
+            dataframe, [column for column in INPUT_COLUMNS if column in dataframe]
+        ).tolist()
+        known = self.row_cache.memory(self.cache_namespace)
+        stored = self.row_cache.load(
+            self.cache_namespace, [key for key in keys if key not in known]
+        )
 
-            if pd.notna(row.article_id_2):
-                article_ids.append(row.article_id_2)
+        if stored:
+            # Rows cached on disk by an earlier session: the API call is rebuilt around the cached body.
+            on_disk = [key in stored for key in keys]
+            disk_rows = dataframe[on_disk]
+            disk_keys = [key for key, row_on_disk in zip(keys, on_disk) if row_on_disk]
+            # One parse of all bodies as a JSON array is much cheaper than a parse per row.
+            bodies = iter(
+                loads(
+                    b"["
+                    + b",".join(
+                        stored[key][1]
+                        for key in disk_keys
+                        if stored[key][1] is not None
+                    )
+                    + b"]"
+                )
+            )
+            for key, ppl_mshp_id, url in zip(
+                disk_keys,
+                disk_rows.peopleMembershipId.tolist(),
+                self.Urls(dataframe=disk_rows).tolist(),
+            ):
+                violations, payload = stored[key]
+                known[key] = (
+                    violations,
+                    None
+                    if payload is None
+                    else {
+                        "ppl_mshp_id": ppl_mshp_id,
+                        "url": url,
+                        "body": next(bodies),
+                        "payload": payload,
+                    },
+                )
 
-            if pd.notna(row.article_id_3):
-                article_ids.append(row.article_id_3)
+        fresh_keys = [key for key in keys if key not in known]
+        if fresh_keys:
+            fresh = dataframe[[key not in known for key in keys]]
+            fresh_violations, invalid = self.Check(dataframe=fresh)
+            row_violations = {}
+            for label, column, value, reason, severity in zip(
+                fresh_violations.index,
+                fresh_violations.column,
+                fresh_violations.value,
+                fresh_violations.reason,
+                fresh_violations.severity,
+            ):
+                row_violations.setdefault(label, []).append(
+                    (column, value, reason, severity)
+                )
 
-            if pd.notna(row.article_id_4):
-                article_ids.append(row.article_id_4)
+            fresh_records = iter(self.Build(dataframe=fresh[~invalid]))
+            entries = []
+            for key, label, row_invalid in zip(fresh_keys, fresh.index, invalid):
+                known[key] = (
+                    row_violations.get(label, []),
+                    None if row_invalid else next(fresh_records),
+                )
+                entries.append((key, *known[key]))
+            self.row_cache.store(self.cache_namespace, entries)
 
-            if pd.notna(row.article_id_5):
-                article_ids.append(row.article_id_5)
+        records = []
+        violations = []
+        for key, label in zip(keys, dataframe.index):
+            row_violations, record = known[key]
+            if record is not None:
+                records.append(record)
+            violations.extend(
+                (label, label + 2, column, value, reason, severity)
+                for column, value, reason, severity in row_violations
+            )
 
-            for id in article_ids:
-                self.IdCheck(id=id, row=row, index=i)  # Validate article IDs
+        if not violations:
+            return pd.DataFrame(columns=VIOLATION_COLUMNS), records
+        violations = pd.DataFrame(
+            violations, columns=["label", *VIOLATION_COLUMNS]
+        ).set_index("label")
+        violations.index.name = None
+        return violations, records
 
-            if article_ids:
-                body = {"articles": []}
+    def Urls(self, dataframe: object) -> object:
+        """Builds the PeopleMembershipChange URL of every row, column-wise."""
+        urls = (
+            self.change_url
+            + dataframe.peopleMembershipId.astype(str)
+            + "/"
+            + dataframe.paymentScheduleId.astype(str)
+            + "?referenceDate="
+            + dataframe.referenceDate.astype(str)
+        )
+        return urls.where(
+            dataframe.promotionId.isna(),
+            urls + "&promotionId=" + dataframe.promotionId.astype(str),
+        )
 
-                for id in article_ids:
-                    body["articles"].append({"id": id, "metadata": "string"})
+    @staticmethod
+    def Bodies(dataframe: object) -> list[dict]:
+        """Builds the request body (article list) of every row."""
+        articles = pd.concat(
+            [getattr(dataframe, column) for column in ARTICLE_COLUMNS], axis=1
+        )
+        article_values = articles.to_numpy(dtype=object)
+        article_present = articles.notna().to_numpy()
+        return [
+            {
+                "articles": [
+                    {"id": id, "metadata": "string"}
+                    for id, present in zip(values, present_mask)
+                    if present
+                ]
+            }
+            if present_mask.any()
+            else {}
+            for values, present_mask in zip(article_values, article_present)
+        ]
 
-            self.new_data.append(
-                {"ppl_mshp_id": row.peopleMembershipId, "url": url, "body": body}
+    def Build(self, dataframe: object) -> list[dict]:
+        """Transforms valid rows to API calls. URLs and article lists are built column-wise."""
+        # The request body is serialized once here, so uploading only sends bytes.
+        return [
+            {
+                "ppl_mshp_id": ppl_mshp_id,
+                "url": url,
+                "body": body,
+                "payload": dumps(body),
+            }
+            for ppl_mshp_id, url, body in zip(
+                dataframe.peopleMembershipId.tolist(),
+                self.Urls(dataframe=dataframe).tolist(),
+                self.Bodies(dataframe=dataframe),
             )
+        ]
 
-        return self.new_data
+    def ViolationSummary(self, limit: int = 20) -> str:
+        """Returns the first `limit` violations as readable lines."""
+        violations = self.Violations()
+        lines = [
+            f"Row {row}, {column}: {reason} (found {value!r})."
+            for row, column, value, reason, _ in violations.head(limit).itertuples(
+                index=False
+            )
+        ]
+        if len(violations) > limit:
+            lines.append(f"... and {len(violations) - limit} more.")
+        return "\n".join(lines)
 
     def Report(self) -> str:
         """Returns report for processed records."""
-        if self.validate:
-            return f"{len(self.new_data)} records validated and ready to upload."
+        warnings = (
+            f" {self.warning_count} of them use IDs not found in the Gym Manager reference data; they are uploaded anyway, see the validation report."
+            if self.warning_count
+            else ""
+        )
+        if self.validate and self.invalid_count:
+            return f"{self.record_count} records validated and ready to upload.{warnings} {self.invalid_count} records failed validation and will be skipped:\n\n{self.ViolationSummary()}"
+        elif self.validate and self.warning_count:
+            return f"{self.record_count} records validated and ready to upload.{warnings}\n\n{self.ViolationSummary()}"
+        elif self.validate:
+            return f"{self.record_count} records validated and ready to upload."
         else:
-            return f"{len(self.new_data)} records ready to upload. Warning: Records are not validated."
+            return f"{self.record_count} records ready to upload. Warning: Records are not validated."
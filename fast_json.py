@@ -0,0 +1,20 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value: object) -> bytes:
+    """Serializes to compact UTF-8 JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def loads(content: bytes) -> object:
+    """Parses JSON bytes, with orjson when it is installed. Raises ValueError on invalid JSON."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
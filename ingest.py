@@ -0,0 +1,133 @@
+import os
+from typing import Iterator
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Every input column is text. Pinning them skips type inference, and IDs made of digits only stay intact.
+INPUT_COLUMNS = [
+    "peopleMembershipId",
+    "paymentScheduleId",
+    "promotionId",
+    "referenceDate",
+    *[f"article_id_{n}" for n in range(1, 6)],
+]
+INPUT_DTYPES = {column: str for column in INPUT_COLUMNS}
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+ARROW_EXTENSIONS = (".feather", ".arrow", ".ipc")
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.000"
+
+
+def file_format(filepath: str) -> str:
+    """Returns "parquet", "arrow" or "csv", by file extension."""
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension in PARQUET_EXTENSIONS:
+        return "parquet"
+    if extension in ARROW_EXTENSIONS:
+        return "arrow"
+    return "csv"
+
+
+def _require_pyarrow(filepath: str) -> None:
+    if pyarrow is None:
+        raise ImportError(f"Reading {filepath} requires pyarrow (pip install pyarrow).")
+
+
+def normalize(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Strips whitespace from text columns with vectorized string ops. Columnar inputs may carry typed columns; those are converted to the text the CSV would hold."""
+    for column in dataframe.columns:
+        values = dataframe[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            dataframe[column] = values.dt.strftime(TIMESTAMP_FORMAT)
+        elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(
+            values
+        ):
+            # Checked first, as pandas string columns are not object dtype but must be stripped too.
+            stripped = values.str.strip()
+            if not pd.api.types.is_object_dtype(values):
+                stripped = stripped.astype(object).where(values.notna())
+            dataframe[column] = stripped
+        elif column in INPUT_DTYPES:
+            dataframe[column] = (
+                values.astype(object).where(values.notna()).map(str, na_action="ignore")
+            )
+    return dataframe
+
+
+def _read_csv(filepath: str, **kwargs) -> object:
+    return pd.read_csv(filepath, delimiter=";", dtype=INPUT_DTYPES, **kwargs)
+
+
+def _arrow_table(filepath: str) -> object:
+    """Opens a Parquet or Arrow IPC (Feather v2) file through a memory map."""
+    _require_pyarrow(filepath)
+    if file_format(filepath) == "parquet":
+        return pyarrow.parquet.read_table(filepath, memory_map=True)
+    return pyarrow.feather.read_table(filepath, memory_map=True)
+
+
+def read(filepath: str) -> pd.DataFrame:
+    """Reads a whole input file: semicolon separated CSV, Parquet or Arrow IPC/Feather."""
+    if file_format(filepath) != "csv":
+        return normalize(_arrow_table(filepath).to_pandas())
+    if pyarrow is not None:
+        # The multithreaded Arrow parser. Called directly, as pandas' engine="pyarrow" turns pinned string nulls into "None".
+        try:
+            return normalize(
+                pyarrow.csv.read_csv(
+                    filepath,
+                    parse_options=pyarrow.csv.ParseOptions(delimiter=";"),
+                    convert_options=pyarrow.csv.ConvertOptions(
+                        column_types={
+                            column: pyarrow.string() for column in INPUT_COLUMNS
+                        },
+                        strings_can_be_null=True,
+                    ),
+                ).to_pandas()
+            )
+        except pyarrow.ArrowInvalid:
+            pass  # E.g. rows with missing fields, which the C parser pads so validation can report them.
+    return normalize(_read_csv(filepath))
+
+
+def read_chunks(filepath: str, chunksize: int) -> Iterator[pd.DataFrame]:
+    """Yields an input file as DataFrames of at most `chunksize` rows, with a running index like a chunked read_csv."""
+    offset = 0
+    if file_format(filepath) == "parquet":
+        _require_pyarrow(filepath)
+        batches = pyarrow.parquet.ParquetFile(filepath, memory_map=True).iter_batches(
+            batch_size=chunksize
+        )
+    elif file_format(filepath) == "arrow":
+        batches = _arrow_table(filepath).to_batches(max_chunksize=chunksize)
+    else:
+        for chunk in _read_csv(filepath, chunksize=chunksize):
+            yield normalize(chunk)
+        return
+
+    for batch in batches:
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield normalize(chunk)
+
+
+def row_count(filepath: str) -> int:
+    """Counts data rows without parsing the file: from the metadata of columnar files, by scanning for line breaks in a CSV."""
+    if file_format(filepath) == "parquet":
+        _require_pyarrow(filepath)
+        return pyarrow.parquet.ParquetFile(filepath).metadata.num_rows
+    if file_format(filepath) == "arrow":
+        return _arrow_table(filepath).num_rows
+
+    with open(filepath, "rb") as file:
+        line_breaks = sum(
+            block.count(b"\n") for block in iter(lambda: file.read(1 << 20), b"")
+        )
+    return max(line_breaks - 1, 0)
@@ -0,0 +1,72 @@
+import json
+import os
+from urllib.parse import parse_qs, urlsplit
+from report import Response
+
+
+def row_key(url: str) -> tuple:
+    """Returns (peopleMembershipId, paymentScheduleId, referenceDate) from a PeopleMembershipChange URL."""
+    parts = urlsplit(url)
+    people_membership_id, payment_schedule_id = parts.path.rstrip("/").split("/")[-2:]
+    reference_date = parse_qs(parts.query).get("referenceDate", [""])[0]
+    return (people_membership_id, payment_schedule_id, reference_date)
+
+
+def change_key(url: str, body: dict) -> tuple:
+    """Identifies one membership change by its full URL (membership, schedule, date, promotion) and its body."""
+    return (url, json.dumps(body, sort_keys=True))
+
+
+class Journal:
+    def __init__(self, filepath: str):
+        """Opens an append-only checkpoint journal. Records of earlier runs are loaded so rows that already succeeded can be skipped; rows recorded by the current run are never skipped."""
+        self.filepath = filepath
+        # Only results of earlier runs; filled once here and not by record().
+        self.entries = {}
+
+        if os.path.exists(self.filepath):
+            with open(self.filepath, "r", encoding="utf-8") as journal_file:
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line of a crashed run.
+                    response = Response(**entry["response"])
+                    self.entries[
+                        change_key(response.post_url, response.body)
+                    ] = response
+
+        self.file = open(self.filepath, "a", encoding="utf-8")
+
+    @staticmethod
+    def for_input(filepath: str) -> "Journal":
+        """Opens the journal belonging to an input file."""
+        return Journal(f"{filepath}.journal.jsonl")
+
+    def completed(self, row: dict) -> Response:
+        """Returns the report entry of this row if the same change (URL and body) already succeeded in an earlier run, else None."""
+        response = self.entries.get(change_key(row["url"], row["body"]))
+        if response is not None and 200 <= response.status_code < 300:
+            return Response(
+                ppl_mshp_id=row["ppl_mshp_id"],
+                status_code=response.status_code,
+                message=response.message,
+                post_url=row["url"],
+                body=row["body"],
+            )
+
+    def record(self, response: Response) -> None:
+        """Appends the result of one row. The line is flushed so it survives a crash of the app."""
+        self.file.write(json.dumps({"response": response.as_dict()}) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
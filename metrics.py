@@ -0,0 +1,291 @@
+import json
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Upper bounds in seconds, as in a Prometheus histogram. The last bucket catches everything slower.
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    float("inf"),
+)
+# queue: waiting for the rate limiter (our side). connect: DNS + TCP. tls: handshake.
+# server: request sent until response headers. transfer: reading the body. total: all of it.
+PHASES = ("queue", "connect", "tls", "server", "transfer", "total")
+
+_connection_timings = threading.local()
+
+
+def reset_connection_timings() -> None:
+    _connection_timings.connect = 0.0
+    _connection_timings.tls = 0.0
+
+
+def connection_timings() -> tuple:
+    """Returns (connect, tls) seconds spent opening connections on this thread since the last reset. Both are 0 for a reused keep-alive connection."""
+    return (
+        getattr(_connection_timings, "connect", 0.0),
+        getattr(_connection_timings, "tls", 0.0),
+    )
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            _connection_timings.connect = (
+                getattr(_connection_timings, "connect", 0.0)
+                + time.perf_counter()
+                - start
+            )
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            _connection_timings.connect = (
+                getattr(_connection_timings, "connect", 0.0)
+                + time.perf_counter()
+                - start
+            )
+
+    def connect(self):
+        # HTTPS connect() is _new_conn() (timed above) followed by the TLS handshake.
+        connect_before = getattr(_connection_timings, "connect", 0.0)
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            new_conn = getattr(_connection_timings, "connect", 0.0) - connect_before
+            _connection_timings.tls = getattr(_connection_timings, "tls", 0.0) + max(
+                time.perf_counter() - start - new_conn, 0.0
+            )
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections report connect and TLS time through connection_timings()."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by linear interpolation inside its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if seen + count >= rank and count:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return lower
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        """Per-request timings aggregated into latency histograms and throughput counters for one upload run."""
+        self.lock = threading.Lock()
+        self.histograms = {phase: Histogram() for phase in PHASES}
+        self.status_classes = {}
+        self.requests = 0
+        self.rows = 0
+        self.bytes_received = 0
+        self.transport_retries = 0
+        self.throttle_retries = 0
+        self.transient_retries = 0
+        self.new_connections = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def record_request(
+        self,
+        status_code: int,
+        queue: float,
+        connect: float,
+        tls: float,
+        server: float,
+        transfer: float,
+        total: float,
+        size: int,
+        retries: int,
+    ) -> None:
+        status_class = f"{status_code // 100}xx" if status_code else "error"
+        with self.lock:
+            for phase, value in zip(
+                PHASES, (queue, connect, tls, server, transfer, total)
+            ):
+                # Connect and TLS are only observed for new connections, not reused keep-alive ones.
+                if value or phase not in ("connect", "tls"):
+                    self.histograms[phase].observe(value)
+            self.status_classes[status_class] = (
+                self.status_classes.get(status_class, 0) + 1
+            )
+            self.requests += 1
+            self.bytes_received += size
+            self.transport_retries += retries
+            self.new_connections += 1 if connect else 0
+
+    def record_row(self, throttle_retries: int = 0, transient_retries: int = 0) -> None:
+        with self.lock:
+            self.rows += 1
+            self.throttle_retries += throttle_retries
+            self.transient_retries += transient_retries
+
+    def finish(self) -> None:
+        self.finished = time.monotonic()
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                "duration_seconds": round(self.duration, 3),
+                "rows": self.rows,
+                "requests": self.requests,
+                "rows_per_second": round(self.rows / self.duration, 2)
+                if self.duration
+                else None,
+                "status_classes": dict(self.status_classes),
+                "bytes_received": self.bytes_received,
+                "transport_retries": self.transport_retries,
+                "throttle_retries": self.throttle_retries,
+                "transient_retries": self.transient_retries,
+                "new_connections": self.new_connections,
+                "latency_seconds": {
+                    phase: histogram.as_dict()
+                    for phase, histogram in self.histograms.items()
+                },
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        """Returns the metrics in Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            lines.append("# TYPE gm_upload_rows_total counter")
+            lines.append(f"gm_upload_rows_total {self.rows}")
+            lines.append("# TYPE gm_upload_requests_total counter")
+            for status_class, count in sorted(self.status_classes.items()):
+                lines.append(
+                    f'gm_upload_requests_total{{status_class="{status_class}"}} {count}'
+                )
+            lines.append("# TYPE gm_upload_bytes_received_total counter")
+            lines.append(f"gm_upload_bytes_received_total {self.bytes_received}")
+            lines.append("# TYPE gm_upload_retries_total counter")
+            lines.append(
+                f'gm_upload_retries_total{{kind="transport"}} {self.transport_retries}'
+            )
+            lines.append(
+                f'gm_upload_retries_total{{kind="throttle"}} {self.throttle_retries}'
+            )
+            lines.append(
+                f'gm_upload_retries_total{{kind="transient"}} {self.transient_retries}'
+            )
+            lines.append("# TYPE gm_upload_new_connections_total counter")
+            lines.append(f"gm_upload_new_connections_total {self.new_connections}")
+            lines.append("# TYPE gm_upload_duration_seconds gauge")
+            lines.append(f"gm_upload_duration_seconds {self.duration:.3f}")
+            lines.append("# TYPE gm_upload_request_seconds histogram")
+            for phase, histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(
+                        f'gm_upload_request_seconds_bucket{{phase="{phase}",le="{le}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'gm_upload_request_seconds_sum{{phase="{phase}"}} {histogram.sum:.6f}'
+                )
+                lines.append(
+                    f'gm_upload_request_seconds_count{{phase="{phase}"}} {histogram.count}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Writes the metrics as Prometheus text for .prom/.txt paths, as JSON otherwise."""
+        with open(path, "w", encoding="utf-8") as metrics_file:
+            if path.endswith((".prom", ".txt")):
+                metrics_file.write(self.to_prometheus())
+            else:
+                metrics_file.write(self.to_json())
+
+    def summary(self) -> str:
+        """One-paragraph breakdown of where the time went, for the GUI console and the CLI."""
+        metrics = self.as_dict()
+        latency = metrics["latency_seconds"]
+
+        def ms(phase: str, quantile: str) -> str:
+            value = latency[phase][quantile]
+            return "-" if value is None else f"{value * 1000:.0f}"
+
+        return (
+            f"{metrics['rows']} rows in {metrics['duration_seconds']} s ({metrics['rows_per_second']} rows/s), "
+            f"{metrics['requests']} requests {metrics['status_classes']}, "
+            f"{metrics['new_connections']} new connections, {metrics['throttle_retries']} throttle retries, {metrics['transient_retries']} retries after transient errors.\n"
+            f"p50/p95 ms - rate limiter wait (our side): {ms('queue', 'p50')}/{ms('queue', 'p95')}, "
+            f"connect: {ms('connect', 'p50')}/{ms('connect', 'p95')}, TLS: {ms('tls', 'p50')}/{ms('tls', 'p95')}, "
+            f"Gym Manager: {ms('server', 'p50')}/{ms('server', 'p95')}, transfer: {ms('transfer', 'p50')}/{ms('transfer', 'p95')}."
+        )
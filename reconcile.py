@@ -0,0 +1,93 @@
+import random
+import time
+from collections import Counter
+from journal import row_key
+from report import Response, Results
+
+MEMBERSHIP_PATH = "/PeopleMemberships/"
+VERIFIED = "verified"
+MISMATCH = "mismatch"
+NOT_FOUND = "not found"
+UNVERIFIED = "unverified"  # The membership could not be fetched, e.g. after a timeout.
+
+
+def targets(results: Results, sample: int = None, seed: int = None) -> list:
+    """Returns the positions of the results to reconcile: per membership, the successful change with the latest referenceDate that is already in effect. Earlier changes were overwritten by it and later ones are not applied yet. With a sample, at most that many memberships are picked at random."""
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    latest = {}  # Membership -> (referenceDate, index).
+    for i, (row, status_code) in enumerate(zip(results.rows, results.status_codes)):
+        if not 200 <= status_code < 300:
+            continue
+        membership, _, reference_date = row_key(row["url"])
+        if reference_date[:19] > now:
+            continue
+        current = latest.get(membership)
+        if current is None or reference_date >= current[0]:
+            latest[membership] = (reference_date, i)
+
+    indexes = [i for _, i in latest.values()]
+    if sample is not None and sample < len(indexes):
+        indexes = random.Random(seed).sample(indexes, sample)
+    return sorted(indexes)
+
+
+def membership_state(data: dict) -> tuple:
+    """Returns (paymentScheduleId, list of article IDs) of a PeopleMembership. Either is None when the API did not return it."""
+    payment_schedule_id = data.get("paymentScheduleId")
+    if payment_schedule_id is None and isinstance(data.get("paymentSchedule"), dict):
+        payment_schedule_id = data["paymentSchedule"].get("id")
+
+    articles = data.get("articles")
+    if isinstance(articles, list):
+        articles = [
+            str(article.get("id") or article.get("articleId"))
+            for article in articles
+            if isinstance(article, dict)
+        ]
+    else:
+        articles = None
+    return payment_schedule_id, articles
+
+
+def compare(response: Response, data: dict) -> str:
+    """Returns "verified" when the membership holds the payment schedule and all articles of the change, else "mismatch: <differences>". IDs are compared case-insensitively."""
+    _, expected_schedule, _ = row_key(response.post_url)
+    payment_schedule_id, articles = membership_state(data)
+    if payment_schedule_id is None and articles is None:
+        return f"{MISMATCH}: membership holds no paymentScheduleId or articles"
+
+    differences = []
+    if (
+        payment_schedule_id is not None
+        and str(payment_schedule_id).lower() != expected_schedule.lower()
+    ):
+        differences.append(
+            f"paymentScheduleId is {payment_schedule_id}, expected {expected_schedule}"
+        )
+    if articles is not None:
+        held = {article.lower() for article in articles}
+        missing = [
+            article["id"]
+            for article in response.body.get("articles", [])
+            if str(article["id"]).lower() not in held
+        ]
+        if missing:
+            differences.append(f"articles missing: {', '.join(missing)}")
+    return f"{MISMATCH}: {'; '.join(differences)}" if differences else VERIFIED
+
+
+def result(response: Response, status_code: int, data: object) -> str:
+    """Returns the reconciliation result of one change, given the status code and data (or error message) of its membership lookup."""
+    if status_code == 200 and isinstance(data, dict):
+        return compare(response, data)
+    if status_code == 404:
+        return NOT_FOUND
+    return f"{UNVERIFIED}: {status_code} {data}"
+
+
+def summary(results: Results) -> Counter:
+    """Counts the reconciliation results by kind."""
+    return Counter(
+        reconciliation.split(":")[0]
+        for reconciliation in results.reconciliation.values()
+    )
@@ -0,0 +1,52 @@
+import json
+import os
+import time
+from atomic_file import write_atomic
+
+DEFAULT_REFERENCE_CACHE = os.path.join(
+    os.path.expanduser("~"), ".gm-api-tool", "reference.json"
+)
+REFERENCE_TTL = 24 * 60 * 60  # Seconds before cached reference data is fetched again.
+REFERENCE_ENDPOINTS = {
+    "paymentSchedules": "/PaymentSchedules",
+    "promotions": "/Promotions",
+    "articles": "/Articles",
+}
+
+
+class ReferenceCache:
+    def __init__(
+        self, filepath: str = DEFAULT_REFERENCE_CACHE, ttl: float = REFERENCE_TTL
+    ):
+        """Keeps the IDs of payment schedules, promotions and articles on disk for `ttl` seconds, per API root."""
+        self.filepath = filepath
+        self.ttl = ttl
+
+    def _read(self) -> dict:
+        try:
+            with open(self.filepath, "r", encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, base_url: str) -> dict:
+        """Returns {kind: frozenset of IDs} if fresh data is cached for `base_url`, else None."""
+        entry = self._read().get(base_url)
+        if entry is not None and entry["fetched_at"] + self.ttl > time.time():
+            return {
+                kind: frozenset(id.upper() for id in ids)
+                for kind, ids in entry["ids"].items()
+            }
+
+    def store(self, base_url: str, reference: dict) -> None:
+        """Caches the IDs of `base_url`. A failed write only means they are fetched again next time, so it is reported and ignored."""
+        entries = self._read()
+        entries[base_url] = {
+            "fetched_at": time.time(),
+            "ids": {kind: sorted(ids) for kind, ids in reference.items()},
+        }
+
+        try:
+            write_atomic(self.filepath, json.dumps(entries))
+        except OSError as error_message:
+            print(f"Could not cache reference data in {self.filepath}: {error_message}")
@@ -0,0 +1,165 @@
+import ast
+import csv
+import json
+from array import array
+
+REPORT_FIELDS = ("ppl_mshp_id", "status_code", "message", "post_url", "body")
+# Reports are written again with this extra column after reconciliation, see reconcile.py.
+RECONCILED_REPORT_FIELDS = (*REPORT_FIELDS, "reconciliation")
+
+
+class Response:
+    """Result of one posted row. Slotted, so large runs hold no per-row dict."""
+
+    __slots__ = RECONCILED_REPORT_FIELDS
+
+    def __init__(
+        self,
+        ppl_mshp_id: str,
+        status_code: int,
+        message: str,
+        post_url: str,
+        body: dict,
+        reconciliation: str = None,
+    ):
+        self.ppl_mshp_id = ppl_mshp_id
+        self.status_code = status_code
+        self.message = message
+        self.post_url = post_url
+        self.body = body
+        self.reconciliation = reconciliation
+
+    def __getitem__(self, field: str):
+        """Allows dict-style access (response["status_code"]) like the former report dicts."""
+        return getattr(self, field)
+
+    def as_dict(self, fields: tuple = REPORT_FIELDS) -> dict:
+        return {field: getattr(self, field) for field in fields}
+
+
+class Results:
+    def __init__(self):
+        """Results of one run, stored column-wise: the posted rows (held by the caller anyway, so only referenced), the status codes in an array and every distinct message once. Responses are built on access, e.g. for the results grid."""
+        self.rows = []
+        self.status_codes = array("i")
+        self.message_codes = array("i")
+        self.messages = []
+        self.message_index = {}  # Message -> position in self.messages.
+        self.reconciliation = {}  # Position -> reconciliation result, see reconcile.py.
+
+    def append(self, row: dict, response: Response) -> None:
+        code = self.message_index.get(response.message)
+        if code is None:
+            code = self.message_index[response.message] = len(self.messages)
+            self.messages.append(response.message)
+        self.rows.append(row)
+        self.status_codes.append(response.status_code)
+        self.message_codes.append(code)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, i: int) -> Response:
+        row = self.rows[i]
+        return Response(
+            ppl_mshp_id=row["ppl_mshp_id"],
+            status_code=self.status_codes[i],
+            message=self.messages[self.message_codes[i]],
+            post_url=row["url"],
+            body=row["body"],
+            reconciliation=self.reconciliation.get(i),
+        )
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class ReportWriter:
+    def __init__(self, filepath: str, fields: tuple = REPORT_FIELDS):
+        """Writes responses to `filepath` as they arrive. Files ending in .jsonl get one JSON object per line, anything else a semicolon separated CSV. Counts the rows written and the failed ones among them."""
+        self.filepath = filepath
+        self.fields = fields
+        self.count = 0
+        self.failed = 0
+        self.jsonl = filepath.endswith(".jsonl")
+        self.file = open(filepath, "w", newline="", encoding="utf-8")
+
+        if not self.jsonl:
+            self.writer = csv.writer(self.file, delimiter=";", lineterminator="\n")
+            self.writer.writerow(self.fields)
+
+    def write(self, response: Response) -> None:
+        self.count += 1
+        if not 200 <= response.status_code < 300:
+            self.failed += 1
+        if self.jsonl:
+            self.file.write(json.dumps(response.as_dict(self.fields)) + "\n")
+        else:
+            self.writer.writerow([getattr(response, field) for field in self.fields])
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> "ReportWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def classify(status_code: int) -> str:
+    """Returns "ok", "transient" (transport errors as status 0, timeouts, throttling, server errors: worth retrying later), "blocked" (not sent after an earlier failure, see scheduler.py) or "permanent" (business errors that fail again unchanged)."""
+    if 200 <= status_code < 300:
+        return "ok"
+    if status_code in (0, 408, 425, 429) or status_code >= 500:
+        return "transient"
+    if status_code == 424:
+        return "blocked"
+    return "permanent"
+
+
+class DeadLetterWriter:
+    def __init__(self, filepath: str):
+        """Writes rows that still failed after all retries to `filepath`, one JSON object per line with the report fields and the failure class. Such a file can be replayed, see read_failures()."""
+        self.filepath = filepath
+        self.count = 0
+        self.file = open(filepath, "w", encoding="utf-8")
+
+    def write(self, response: Response) -> None:
+        failure = classify(response.status_code)
+        if failure != "ok":
+            self.file.write(
+                json.dumps({**response.as_dict(), "failure": failure}) + "\n"
+            )
+            self.count += 1
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> "DeadLetterWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_failures(filepath: str) -> list[dict]:
+    """Reads the failed rows of a report (CSV or JSONL) or dead-letter file back into rows for GymManager.post_data."""
+    with open(filepath, "r", newline="", encoding="utf-8") as report_file:
+        if filepath.endswith(".jsonl"):
+            entries = [json.loads(line) for line in report_file if line.strip()]
+        else:
+            entries = list(csv.DictReader(report_file, delimiter=";"))
+            for entry in entries:
+                # CSV reports hold the body as a Python literal.
+                entry["body"] = ast.literal_eval(entry["body"])
+
+    return [
+        {
+            "ppl_mshp_id": entry["ppl_mshp_id"],
+            "url": entry["post_url"],
+            "body": entry["body"],
+        }
+        for entry in entries
+        if classify(int(entry["status_code"])) != "ok"
+    ]
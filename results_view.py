@@ -0,0 +1,253 @@
+import numpy as np
+import pandas as pd
+from tkinter import ttk
+from customtkinter import (
+    CTkButton,
+    CTkComboBox,
+    CTkEntry,
+    CTkFrame,
+    CTkLabel,
+    CTkToplevel,
+)
+from constants import UNIVERSAL_PADDING, UNIVERSAL_X_PADDING
+from report import Results
+
+PAGE_ROWS = 25  # Rows in the table at any time; the rest are never rendered.
+SCROLL_ROWS = 3  # Rows moved per mouse wheel step.
+# Milliseconds after the last keystroke before the filter is applied.
+FILTER_DELAY = 200
+RESULT_COLUMNS = {
+    "row": 60,
+    "ppl_mshp_id": 280,
+    "status_code": 80,
+    "message": 320,
+    "reconciliation": 260,
+}
+# Columns with few distinct values; they are indexed by those values, which the message filter searches.
+LABEL_COLUMNS = ("message", "reconciliation")
+
+
+class ResultsIndex:
+    def __init__(self, results: Results):
+        """Columnar index over the results of one run. Messages are coded by their sorted distinct values, so filtering only scans the distinct messages and sorting is an argsort of integers. Sort orders are computed on first use and cached."""
+        self.results = results
+        self.status_codes = np.array(results.status_codes, dtype=np.int64)
+        # Fixed-width strings sort several times faster than Python objects.
+        self.ids = np.array([row["ppl_mshp_id"] for row in results.rows], dtype=str)
+        self.codes = {}
+        self.labels = {}
+        # Results already hold each message once; only their codes are put in sorted order.
+        messages = np.array(results.messages, dtype=object)
+        order = np.argsort(messages, kind="stable")
+        ranks = np.empty(len(messages), dtype=np.int64)
+        ranks[order] = np.arange(len(messages))
+        self.codes["message"] = ranks[np.array(results.message_codes, dtype=np.int64)]
+        self.labels["message"] = messages[order]
+        reconciliation = np.full(len(results), None, dtype=object)
+        for i, result in results.reconciliation.items():
+            reconciliation[i] = result
+        codes, labels = pd.factorize(reconciliation, sort=True)
+        self.codes["reconciliation"] = codes
+        self.labels["reconciliation"] = labels
+        self.orders = {}
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def statuses(self) -> list[int]:
+        return np.unique(self.status_codes).tolist()
+
+    def order(self, column: str, descending: bool = False) -> np.ndarray:
+        """Returns the row positions sorted by `column`."""
+        if column not in self.orders:
+            if column == "row":
+                keys = np.arange(len(self))
+            elif column == "status_code":
+                keys = self.status_codes
+            elif column == "ppl_mshp_id":
+                keys = self.ids
+            else:
+                keys = self.codes[column]
+            self.orders[column] = np.argsort(keys, kind="stable")
+        order = self.orders[column]
+        return order[::-1] if descending else order
+
+    def select(
+        self,
+        status: int = None,
+        text: str = "",
+        column: str = "row",
+        descending: bool = False,
+    ) -> np.ndarray:
+        """Returns the positions of the rows with the given status code and whose message or reconciliation result contains `text` (case-insensitive), sorted by `column`."""
+        mask = None
+        if status is not None:
+            mask = self.status_codes == status
+        if text:
+            text = text.lower()
+            matches = np.zeros(len(self), dtype=bool)
+            for label_column in LABEL_COLUMNS:
+                matching_labels = [
+                    code
+                    for code, label in enumerate(self.labels[label_column])
+                    if text in str(label).lower()
+                ]
+                matches |= np.isin(self.codes[label_column], matching_labels)
+            mask = matches if mask is None else mask & matches
+
+        order = self.order(column, descending)
+        return order if mask is None else order[mask[order]]
+
+
+class ResultsWindow(CTkToplevel):
+    def __init__(self, master: object, index: ResultsIndex):
+        """Table of upload results that only renders the visible page of rows, so it stays responsive for runs of a million rows. Rows can be filtered by status code and message and sorted by clicking a column heading."""
+        super().__init__(master)
+        self.title(f"Results ({len(index)} rows)")
+        self.geometry("1100x650")
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(1, weight=1)
+        self.index = index
+        self.view = index.select()
+        self.offset = 0
+        self.sort_column = "row"
+        self.descending = False
+        self.pending_filter = None
+
+        self.frame_filter = CTkFrame(self)
+        self.frame_filter.grid(
+            column=0,
+            row=0,
+            padx=UNIVERSAL_X_PADDING,
+            pady=UNIVERSAL_PADDING,
+            sticky="ew",
+        )
+        self.label_status = CTkLabel(self.frame_filter, text="Status")
+        self.label_status.grid(column=0, row=0, padx=UNIVERSAL_X_PADDING)
+        self.combobox_status = CTkComboBox(
+            self.frame_filter,
+            values=["All", *(str(status) for status in index.statuses())],
+            command=lambda _: self.apply_filter(),
+            width=90,
+        )
+        self.combobox_status.set("All")
+        self.combobox_status.grid(column=1, row=0, pady=UNIVERSAL_PADDING)
+        self.entry_message = CTkEntry(
+            self.frame_filter, placeholder_text="Filter message", width=300
+        )
+        self.entry_message.grid(column=2, row=0, padx=UNIVERSAL_X_PADDING)
+        self.entry_message.bind("<KeyRelease>", self.schedule_filter)
+
+        self.tree = ttk.Treeview(
+            self, columns=tuple(RESULT_COLUMNS), show="headings", height=PAGE_ROWS
+        )
+        for column, width in RESULT_COLUMNS.items():
+            self.tree.heading(
+                column, text=column, command=lambda column=column: self.sort(column)
+            )
+            self.tree.column(column, width=width, stretch=column == "message")
+        self.tree.grid(column=0, row=1, padx=(UNIVERSAL_X_PADDING, 0), sticky="nsew")
+        # The scrollbar spans the whole selection, while the tree only holds the visible page.
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.scroll)
+        self.scrollbar.grid(column=1, row=1, padx=(0, UNIVERSAL_X_PADDING), sticky="ns")
+        self.tree.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.tree.bind("<Button-4>", lambda _: self.move(-SCROLL_ROWS))
+        self.tree.bind("<Button-5>", lambda _: self.move(SCROLL_ROWS))
+
+        self.frame_pages = CTkFrame(self, fg_color="transparent")
+        self.frame_pages.grid(
+            column=0,
+            row=2,
+            padx=UNIVERSAL_X_PADDING,
+            pady=UNIVERSAL_PADDING,
+            sticky="ew",
+        )
+        self.button_previous = CTkButton(
+            self.frame_pages,
+            text="Previous",
+            width=90,
+            command=lambda: self.move(-PAGE_ROWS),
+        )
+        self.button_previous.grid(column=0, row=0)
+        self.button_next = CTkButton(
+            self.frame_pages,
+            text="Next",
+            width=90,
+            command=lambda: self.move(PAGE_ROWS),
+        )
+        self.button_next.grid(column=1, row=0, padx=UNIVERSAL_X_PADDING)
+        self.label_position = CTkLabel(self.frame_pages, text="")
+        self.label_position.grid(column=2, row=0)
+
+        self.render()
+
+    def render(self) -> None:
+        """Replaces the table contents with the rows at the current offset."""
+        self.tree.delete(*self.tree.get_children())
+        page = self.view[self.offset : self.offset + PAGE_ROWS]
+        for position in page.tolist():
+            response = self.index.results[position]
+            self.tree.insert(
+                "",
+                "end",
+                values=(
+                    position + 1,
+                    response.ppl_mshp_id,
+                    response.status_code,
+                    response.message,
+                    response.reconciliation or "",
+                ),
+            )
+
+        total = len(self.view)
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + len(page)) / total)
+            position = f"Rows {self.offset + 1}-{self.offset + len(page)} of {total}"
+        else:
+            self.scrollbar.set(0, 1)
+            position = "No matching rows"
+        if total != len(self.index):
+            position += f" (filtered from {len(self.index)})"
+        self.label_position.configure(text=position)
+
+    def move(self, rows: int) -> None:
+        self.offset = max(0, min(self.offset + rows, len(self.view) - PAGE_ROWS))
+        self.render()
+
+    def scroll(self, action: str, amount: str, unit: str = None) -> None:
+        """Scrollbar callback: ("moveto", fraction) or ("scroll", steps, "units" | "pages")."""
+        if action == "moveto":
+            self.offset = 0
+            self.move(int(float(amount) * len(self.view)))
+        else:
+            self.move(int(amount) * (PAGE_ROWS if unit == "pages" else 1))
+
+    def on_mouse_wheel(self, event: object) -> None:
+        self.move(-SCROLL_ROWS if event.delta > 0 else SCROLL_ROWS)
+
+    def schedule_filter(self, event: object = None) -> None:
+        """Applies the filter once typing pauses, not on every keystroke."""
+        if self.pending_filter is not None:
+            self.after_cancel(self.pending_filter)
+        self.pending_filter = self.after(FILTER_DELAY, self.apply_filter)
+
+    def apply_filter(self) -> None:
+        self.pending_filter = None
+        status = self.combobox_status.get()
+        self.view = self.index.select(
+            status=None if status == "All" else int(status),
+            text=self.entry_message.get().strip(),
+            column=self.sort_column,
+            descending=self.descending,
+        )
+        self.offset = 0
+        self.render()
+
+    def sort(self, column: str) -> None:
+        """Sorts by `column`; clicking the same heading again reverses the order."""
+        self.descending = column == self.sort_column and not self.descending
+        self.sort_column = column
+        for heading in RESULT_COLUMNS:
+            arrow = (" ▼" if self.descending else " ▲") if heading == column else ""
+            self.tree.heading(heading, text=heading + arrow)
+        self.apply_filter()
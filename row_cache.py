@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+DEFAULT_ROW_CACHE = os.path.join(os.path.expanduser("~"), ".gm-api-tool", "rows.sqlite")
+ROW_CACHE_TTL = 30 * 24 * 60 * 60  # Seconds before a cached row is validated again.
+# Bump when validation or payload building changes, so stale results are never reused.
+ROW_CACHE_VERSION = 2
+LOOKUP_BATCH = 500  # Keys per SELECT; stays below SQLite's variable limit.
+# Rows kept in memory; beyond this the memory layer starts over.
+ROW_CACHE_MEMORY = 1_000_000
+
+
+def row_hashes(dataframe: pd.DataFrame, columns: list) -> np.ndarray:
+    """Returns a 64-bit content hash per row of the given (normalized) columns, as signed integers for SQLite."""
+    return (
+        pd.util.hash_pandas_object(dataframe[columns], index=False, categorize=False)
+        .to_numpy()
+        .view(np.int64)
+    )
+
+
+def reference_fingerprint(reference: dict) -> str:
+    """Returns a digest of the reference IDs, so results checked against other reference data are not reused."""
+    if reference is None:
+        return "none"
+    digest = hashlib.sha256()
+    for kind in sorted(reference):
+        digest.update(kind.encode())
+        for id in sorted(reference[kind]):
+            digest.update(b"\0" + id.encode())
+    return digest.hexdigest()
+
+
+class RowCache:
+    def __init__(self, filepath: str = DEFAULT_ROW_CACHE, ttl: float = ROW_CACHE_TTL):
+        """Keeps the validation result and request body of every row seen, keyed by a hash of the row's content. Re-reading a lightly edited file then only validates and builds the changed rows. Within one process the built API calls are also kept in memory, which skips the disk and all per-row work."""
+        self.filepath = filepath
+        self.ttl = ttl
+        self.memories = {}
+        os.makedirs(os.path.dirname(os.path.abspath(self.filepath)), exist_ok=True)
+        self.connection = sqlite3.connect(self.filepath, timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS rows ("
+            "namespace TEXT, key INTEGER, stored_at REAL, violations TEXT, payload BLOB, "
+            "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM rows WHERE stored_at < ?", (time.time() - self.ttl,)
+            )
+
+    @staticmethod
+    def namespace(validate: bool, change_url: str, reference: dict) -> str:
+        """Results depend on the validate flag, the API root and the reference data."""
+        return hashlib.sha256(
+            f"{ROW_CACHE_VERSION}\0{validate}\0{change_url}\0{reference_fingerprint(reference)}".encode()
+        ).hexdigest()[:16]
+
+    def memory(self, namespace: str) -> dict:
+        """Returns the in-memory {key: (violations, record)} of a namespace; record is None for invalid rows."""
+        if sum(len(memory) for memory in self.memories.values()) > ROW_CACHE_MEMORY:
+            self.memories.clear()
+        return self.memories.setdefault(namespace, {})
+
+    def load(self, namespace: str, keys: list) -> dict:
+        """Returns {key: (violations, payload)} for the cached keys. violations is a list of (column, value, reason, severity); payload is the JSON request body of valid rows, else None."""
+        unique_keys = list(set(keys))
+        found = {}
+        for start in range(0, len(unique_keys), LOOKUP_BATCH):
+            batch = unique_keys[start : start + LOOKUP_BATCH]
+            for key, violations, payload in self.connection.execute(
+                "SELECT key, violations, payload FROM rows "
+                f"WHERE namespace = ? AND key IN ({','.join('?' * len(batch))})",
+                (namespace, *batch),
+            ):
+                found[key] = (
+                    [tuple(v) for v in json.loads(violations)] if violations else [],
+                    payload,
+                )
+        return found
+
+    def store(self, namespace: str, entries: list) -> None:
+        """Stores (key, violations, record) per row; see memory()."""
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?, ?)",
+                (
+                    (
+                        namespace,
+                        key,
+                        now,
+                        json.dumps(violations) if violations else None,
+                        record["payload"] if record else None,
+                    )
+                    for key, violations, record in entries
+                ),
+            )
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,88 @@
+import heapq
+from collections import deque
+from typing import Iterable
+from journal import row_key
+from report import Response
+
+# Rows buffered ahead of a streamed input. Changes to one membership are only put in referenceDate order within this window.
+STREAM_LOOKAHEAD = 10_000
+# Status recorded for rows that were not sent because an earlier change to the same membership failed (HTTP 424 Failed Dependency).
+BLOCKED_STATUS = 424
+
+
+class MembershipScheduler:
+    def __init__(self, rows: Iterable[dict], lookahead: int = None):
+        """Hands out rows so that changes to one peopleMembershipId are sent one at a time, oldest referenceDate first, while different memberships run in parallel. With a lookahead, at most that many rows are read ahead of the ones sent; without one, all rows are read first and ordered globally."""
+        self.rows = enumerate(rows)
+        self.lookahead = lookahead
+        # Membership -> heap of (referenceDate, index, row) not sent yet.
+        self.queues = {}
+        self.ready = deque()  # Memberships with queued rows and none in flight.
+        self.active = set()  # Memberships with a row in flight.
+        self.in_flight = {}  # Index -> membership.
+        # Membership -> message of its failed row, while rows of the membership are waiting.
+        self.failed = {}
+        self.buffered = 0
+        self.exhausted = False
+
+    def _fill(self) -> None:
+        while not self.exhausted and (
+            self.lookahead is None or self.buffered < self.lookahead
+        ):
+            next_row = next(self.rows, None)
+            if next_row is None:
+                self.exhausted = True
+                break
+
+            i, row = next_row
+            membership, _, reference_date = row_key(row["url"])
+            queue = self.queues.get(membership)
+            if queue is None:
+                queue = self.queues[membership] = []
+                if membership not in self.active:
+                    self.ready.append(membership)
+            heapq.heappush(queue, (reference_date, i, row))
+            self.buffered += 1
+
+    @property
+    def done(self) -> bool:
+        """True once every row was handed out."""
+        return self.exhausted and not self.buffered
+
+    def next(self) -> tuple:
+        """Returns (index, row, failure) of the next row that may be sent, or None while every waiting membership has a row in flight. failure is the message of an earlier failed change to the same membership, in which case the row must not be sent; see blocked()."""
+        self._fill()
+        if not self.ready:
+            return None
+
+        membership = self.ready.popleft()
+        _, i, row = heapq.heappop(self.queues[membership])
+        self.buffered -= 1
+        self.active.add(membership)
+        self.in_flight[i] = membership
+        return i, row, self.failed.get(membership)
+
+    def complete(self, i: int, response: Response) -> None:
+        """Releases the membership of row `i`. A failure blocks the membership's later rows."""
+        membership = self.in_flight.pop(i)
+        if not 200 <= response.status_code < 300:
+            self.failed.setdefault(membership, response.message)
+
+        self.active.discard(membership)
+        if self.queues[membership]:
+            self.ready.append(membership)
+        else:
+            # Forgotten like the row order: a later row beyond the lookahead is sent as usual.
+            del self.queues[membership]
+            self.failed.pop(membership, None)
+
+    @staticmethod
+    def blocked(row: dict, failure: str) -> Response:
+        """Returns the report entry of a row that was held back after an earlier failure."""
+        return Response(
+            ppl_mshp_id=row["ppl_mshp_id"],
+            status_code=BLOCKED_STATUS,
+            message=f"Not sent, an earlier change to this membership failed: {failure}",
+            post_url=row["url"],
+            body=row["body"],
+        )
@@ -0,0 +1,208 @@
+import csv
+import heapq
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from constants import BASE_URL
+
+ROW_COLUMN = "_row"  # Position of the record in the original input file (0-based).
+SPLIT_CHUNKSIZE = 100_000
+
+
+def shard_path(shard_dir: str, shard: int, suffix: str) -> str:
+    return os.path.join(shard_dir, f"shard-{shard}{suffix}")
+
+
+def split(filepath: str, shard_dir: str, shards: int) -> None:
+    """Splits an input file into `shards` files by a stable hash of peopleMembershipId. All rows of one membership land in the same shard, in input order."""
+    import pandas as pd
+    import ingest
+
+    os.makedirs(shard_dir, exist_ok=True)
+    for shard in range(shards):
+        # A new split invalidates earlier results; journals are kept, so finished rows are still skipped.
+        for suffix in (".done", ".rows.json", ".violations.csv"):
+            if os.path.exists(shard_path(shard_dir, shard, suffix)):
+                os.remove(shard_path(shard_dir, shard, suffix))
+    headers_written = set()
+    offset = 0
+
+    for chunk in ingest.read_chunks(filepath, SPLIT_CHUNKSIZE):
+        chunk.insert(0, ROW_COLUMN, range(offset, offset + len(chunk)))
+        offset += len(chunk)
+        # hash_pandas_object uses a fixed key, so every machine computes the same shard.
+        keys = pd.util.hash_pandas_object(
+            chunk.peopleMembershipId.fillna(""), index=False
+        )
+        for shard, rows in chunk.groupby((keys % shards).to_numpy(), sort=False):
+            rows.to_csv(
+                shard_path(shard_dir, shard, ".csv"),
+                sep=";",
+                index=False,
+                mode="a" if shard in headers_written else "w",
+                header=shard not in headers_written,
+            )
+            headers_written.add(shard)
+
+    for shard in range(shards):
+        if shard not in headers_written:
+            # Empty shards still get a file, so every worker has an input.
+            pd.DataFrame(columns=[ROW_COLUMN, *ingest.INPUT_COLUMNS]).to_csv(
+                shard_path(shard_dir, shard, ".csv"), sep=";", index=False
+            )
+
+    with open(os.path.join(shard_dir, "manifest.json"), "w") as manifest:
+        json.dump({"input": os.path.abspath(filepath), "shards": shards}, manifest)
+
+
+def work(
+    shard_dir: str,
+    shard: int,
+    user_name: str,
+    password: str,
+    concurrency: int = 8,
+    validate: bool = True,
+    base_url: str = BASE_URL,
+) -> str:
+    """Validates, transforms and uploads one shard with its own GymManager. Can run in a local worker process or on another machine sharing `shard_dir`."""
+    from api import POOL_SIZE, GymManager
+    from data import ERROR, TransformData
+    from journal import Journal
+    from token_cache import TokenCache
+
+    filepath = shard_path(shard_dir, shard, ".csv")
+    # Shared by the workers, so a token fetched by one is reused by the others.
+    api = GymManager(
+        base_url=base_url,
+        pool_size=max(concurrency, POOL_SIZE),
+        token_cache=TokenCache(),
+    )
+    api.authenticate(user_name=user_name, password=password)
+
+    transform_data = TransformData(
+        filepath=filepath, validate=validate, base_url=base_url
+    )
+    data = transform_data.Output()
+    violations = transform_data.Violations()
+    # Output keeps the valid rows in file order, so their input positions line up with the responses.
+    rows = transform_data.df.drop(
+        index=violations.index[violations.severity == ERROR].unique()
+    )[ROW_COLUMN].astype(int)
+
+    with Journal.for_input(filepath) as journal:
+        api.post_data(
+            data=data,
+            concurrency=concurrency,
+            journal=journal,
+            report_path=shard_path(shard_dir, shard, ".report.csv"),
+        )
+
+    with open(shard_path(shard_dir, shard, ".rows.json"), "w") as rows_file:
+        json.dump(rows.tolist()[: api.processed], rows_file)
+
+    if len(violations):
+        # Row numbers in the input file, not in the shard.
+        violations["row"] = (
+            transform_data.df.loc[violations.index, ROW_COLUMN].astype(int) + 2
+        )
+        violations.to_csv(
+            shard_path(shard_dir, shard, ".violations.csv"), sep=";", index=False
+        )
+
+    open(shard_path(shard_dir, shard, ".done"), "w").close()
+    return api.report()
+
+
+def _read_shard(shard_dir: str, shard: int):
+    """Yields (input row, report row) for one finished shard."""
+    with open(shard_path(shard_dir, shard, ".rows.json")) as rows_file:
+        rows = json.load(rows_file)
+    with open(
+        shard_path(shard_dir, shard, ".report.csv"), newline="", encoding="utf-8"
+    ) as report_file:
+        reader = csv.reader(report_file, delimiter=";")
+        next(reader)
+        yield from zip(rows, reader)
+
+
+def merge(shard_dir: str, report_path: str = "report.csv") -> int:
+    """Merges the shard reports into one report in input order. Returns the number of rows written."""
+    from report import REPORT_FIELDS
+
+    with open(os.path.join(shard_dir, "manifest.json")) as manifest:
+        shards = json.load(manifest)["shards"]
+
+    missing = [
+        shard
+        for shard in range(shards)
+        if not os.path.exists(shard_path(shard_dir, shard, ".done"))
+    ]
+    if missing:
+        raise FileNotFoundError(f"Shards not finished yet: {missing}")
+
+    written = 0
+    with open(report_path, "w", newline="", encoding="utf-8") as report_file:
+        writer = csv.writer(report_file, delimiter=";", lineterminator="\n")
+        writer.writerow(REPORT_FIELDS)
+        # Each shard is already in input order, so a k-way merge keeps memory flat.
+        for _, row in heapq.merge(
+            *(_read_shard(shard_dir, shard) for shard in range(shards)),
+            key=lambda item: item[0],
+        ):
+            writer.writerow(row)
+            written += 1
+
+    violation_files = [
+        shard_path(shard_dir, shard, ".violations.csv")
+        for shard in range(shards)
+        if os.path.exists(shard_path(shard_dir, shard, ".violations.csv"))
+    ]
+    if violation_files:
+        import pandas as pd
+
+        pd.concat(
+            pd.read_csv(path, sep=";", dtype={"value": str}) for path in violation_files
+        ).sort_values("row").to_csv(
+            os.path.join(
+                os.path.dirname(os.path.abspath(report_path)), "validation_report.csv"
+            ),
+            sep=";",
+            index=False,
+        )
+
+    return written
+
+
+def run(
+    filepath: str,
+    shards: int,
+    user_name: str,
+    password: str,
+    shard_dir: str = None,
+    concurrency: int = 8,
+    validate: bool = True,
+    base_url: str = BASE_URL,
+    report_path: str = "report.csv",
+) -> int:
+    """Splits, uploads every shard in its own local process, and merges the reports."""
+    shard_dir = shard_dir or f"{filepath}.shards"
+    split(filepath=filepath, shard_dir=shard_dir, shards=shards)
+
+    with ProcessPoolExecutor(max_workers=shards) as executor:
+        futures = [
+            executor.submit(
+                work,
+                shard_dir=shard_dir,
+                shard=shard,
+                user_name=user_name,
+                password=password,
+                concurrency=concurrency,
+                validate=validate,
+                base_url=base_url,
+            )
+            for shard in range(shards)
+        ]
+        for future in futures:
+            future.result()
+
+    return merge(shard_dir=shard_dir, report_path=report_path)
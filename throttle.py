@@ -0,0 +1,131 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+ADDITIVE_INCREASE = 5.0  # Requests per second added each second after slow start.
+
+
+def retry_after(value: str) -> float:
+    """Parses a Retry-After header, given in seconds or as an HTTP date. Returns the delay in seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate: float = 20.0,
+        min_rate: float = 1.0,
+        max_rate: float = 500.0,
+        concurrency: int = 8,
+    ):
+        """Token bucket that adapts its rate (requests per second) and the number of requests in flight to 429/5xx responses, latency and Retry-After headers."""
+        # Slow start raises the rate by 5% per success until the first throttled response, then additively.
+        self.condition = threading.Condition()
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.max_concurrency = concurrency
+        self.limit = concurrency
+        self.active = 0
+        self.successes = 0
+        self.slow_start = True
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.latency = None
+        self.baseline_latency = None
+        self.throttled = 0
+
+    def reset(self, concurrency: int) -> None:
+        """Sets the concurrency ceiling for a new run. The learned rate is kept."""
+        with self.condition:
+            self.max_concurrency = max(1, concurrency)
+            self.limit = min(max(self.limit, 1), self.max_concurrency)
+            self.throttled = 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.tokens + (now - self.updated) * self.rate, max(self.rate, 1.0)
+        )
+        self.updated = now
+
+    def acquire(self) -> None:
+        """Blocks until a token is available and the concurrency limit allows another request."""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                elif self.active >= self.limit:
+                    self.condition.wait()
+                elif self.tokens < 1.0:
+                    self.condition.wait((1.0 - self.tokens) / self.rate)
+                else:
+                    self.tokens -= 1.0
+                    self.active += 1
+                    return
+
+    def release(self, status_code: int, latency: float, delay: float = None) -> None:
+        """Returns the slot of a finished request and adapts rate and concurrency to its outcome."""
+        with self.condition:
+            self.active -= 1
+            now = time.monotonic()
+
+            if status_code is None or status_code == 429 or status_code >= 500:
+                if status_code == 429:
+                    self.throttled += 1
+                if delay is not None:
+                    self.paused_until = max(self.paused_until, now + delay)
+                if now - self.last_decrease >= 1.0:
+                    # One decrease per second, so a burst of in-flight failures is not counted many times over.
+                    self.rate = max(self.rate / 2, self.min_rate)
+                    self.limit = max(self.limit // 2, 1)
+                    self.last_decrease = now
+                    self.slow_start = False
+            else:
+                self.latency = (
+                    latency
+                    if self.latency is None
+                    else 0.8 * self.latency + 0.2 * latency
+                )
+                if (
+                    self.baseline_latency is None
+                    or self.latency < self.baseline_latency
+                ):
+                    self.baseline_latency = self.latency
+                else:
+                    # Drift up slowly, so a lasting change in latency becomes the new normal.
+                    self.baseline_latency += 0.01 * (
+                        self.latency - self.baseline_latency
+                    )
+
+                self.rate = min(
+                    self.rate * 1.05
+                    if self.slow_start
+                    else self.rate + ADDITIVE_INCREASE / self.rate,
+                    self.max_rate,
+                )
+                if self.latency > 2 * self.baseline_latency:
+                    # The server slows down before it starts refusing; back off on concurrency first.
+                    if now - self.last_decrease >= 1.0:
+                        self.limit = max(self.limit - 1, 1)
+                        self.last_decrease = now
+                else:
+                    self.successes += 1
+                    if self.successes >= self.limit:
+                        self.limit = min(self.limit + 1, self.max_concurrency)
+                        self.successes = 0
+
+            self.condition.notify_all()
@@ -0,0 +1,93 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from atomic_file import write_atomic
+
+DEFAULT_TOKEN_CACHE = os.path.join(
+    os.path.expanduser("~"), ".gm-api-tool", "token.json"
+)
+# Seconds; used when the token does not carry an expiry.
+DEFAULT_TOKEN_LIFETIME = 30 * 60
+# PBKDF2 rounds of the password verifier; slow enough to make guessing the password from the file expensive.
+VERIFIER_ITERATIONS = 200_000
+
+
+def token_expiry(token: str) -> float:
+    """Returns the expiry (epoch seconds) of a JWT bearer token. Falls back to DEFAULT_TOKEN_LIFETIME from now for opaque tokens."""
+    try:
+        payload = token.split()[-1].split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + DEFAULT_TOKEN_LIFETIME
+
+
+class TokenCache:
+    def __init__(self, filepath: str = DEFAULT_TOKEN_CACHE):
+        """Stores bearer tokens on disk, so repeated runs can skip the login round-trip. Tokens are keyed by API root and user name; each carries a salted PBKDF2 verifier of the password, so a wrong password never reuses a token and the file gives no fast way to test password guesses."""
+        self.filepath = filepath
+
+    @staticmethod
+    def key(base_url: str, user_name: str) -> str:
+        return hashlib.sha256(f"{base_url}\0{user_name}".encode()).hexdigest()
+
+    @staticmethod
+    def verifier(password: str, salt: bytes) -> str:
+        return hashlib.pbkdf2_hmac(
+            "sha256", password.encode(), salt, VERIFIER_ITERATIONS
+        ).hex()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.filepath, "r", encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def load(
+        self, base_url: str, user_name: str, password: str, margin: float = 0
+    ) -> tuple:
+        """Returns (token, expires_at) if a token is cached for these credentials that stays valid for at least `margin` seconds, else None."""
+        entry = self._read().get(self.key(base_url, user_name))
+        if (
+            entry is not None
+            and entry["expires_at"] - margin > time.time()
+            and hmac.compare_digest(
+                entry["verifier"],
+                self.verifier(password, bytes.fromhex(entry["salt"])),
+            )
+        ):
+            return entry["token"], entry["expires_at"]
+
+    def store(
+        self,
+        base_url: str,
+        user_name: str,
+        password: str,
+        token: str,
+        expires_at: float,
+    ) -> None:
+        """Adds a token and drops expired ones. A failed write only costs a login next time, so it is reported and ignored."""
+        entries = {
+            cached_key: entry
+            for cached_key, entry in self._read().items()
+            if entry["expires_at"] > time.time()
+        }
+        salt = os.urandom(16)
+        entries[self.key(base_url, user_name)] = {
+            "token": token,
+            "expires_at": expires_at,
+            "salt": salt.hex(),
+            "verifier": self.verifier(password, salt),
+        }
+
+        try:
+            # Readable by the current user only; the file holds live bearer tokens.
+            write_atomic(self.filepath, json.dumps(entries))
+        except OSError as error_message:
+            print(f"Could not cache the token in {self.filepath}: {error_message}")
@@ -0,0 +1,182 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from api import GymManager
+from atomic_file import write_atomic
+from data import TransformData
+from journal import Journal
+from reference import REFERENCE_TTL
+from row_cache import RowCache
+
+WATCH_EXTENSIONS = (".csv", ".parquet", ".pq", ".feather", ".arrow")
+# Files this tool writes next to an input; never picked up as inputs themselves.
+OUTPUT_SUFFIXES = (".report.csv", ".validation_report.csv")
+STATE_FILE = ".gm-watch.json"
+
+
+class Watcher:
+    def __init__(
+        self,
+        directory: str,
+        api: GymManager,
+        validate: bool = True,
+        reference_check: bool = True,
+        concurrency: int = 8,
+        interval: float = 5,
+        settle: float = 10,
+        row_cache: RowCache = None,
+    ):
+        """Watches `directory` for new input files and uploads them one by one with the authenticated `api`, so the session, token and reference data are shared by all files. A file is picked up once its size and modification time stayed the same for `settle` seconds, so files still being copied in are left alone."""
+        self.directory = os.path.abspath(directory)
+        self.api = api
+        self.validate = validate
+        self.reference_check = reference_check
+        self.concurrency = concurrency
+        self.interval = interval
+        self.settle = settle
+        self.row_cache = row_cache
+        self.state_path = os.path.join(directory, STATE_FILE)
+        self.processed = self._load_state()
+        self.pending = deque()
+        self.candidates = {}  # Path -> (size, mtime, first seen unchanged).
+        self.reference_loaded = None
+        self.stop_event = threading.Event()
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self) -> None:
+        write_atomic(self.state_path, json.dumps(self.processed, indent=2))
+
+    @staticmethod
+    def log(message: str) -> None:
+        print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}", flush=True)
+
+    def scan(self) -> None:
+        """Queues input files that are new or changed since they were processed, once they are stable."""
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.directory):
+            name = entry.name.lower()
+            if (
+                entry.is_file()
+                and name.endswith(WATCH_EXTENSIONS)
+                and not name.endswith(OUTPUT_SUFFIXES)
+                and entry.path not in self.pending
+            ):
+                try:
+                    files.append((entry.stat(), entry))
+                except OSError:
+                    continue  # Removed or renamed meanwhile.
+
+        for stat, entry in sorted(files, key=lambda file: file[0].st_mtime):
+            signature = [stat.st_size, stat.st_mtime]
+            if self.processed.get(entry.path, {}).get("signature") == signature:
+                continue
+
+            size, mtime, since = self.candidates.get(entry.path, (None, None, now))
+            if (size, mtime) != tuple(signature):
+                self.candidates[entry.path] = (*signature, now)
+            elif now - since >= self.settle:
+                del self.candidates[entry.path]
+                self.pending.append(entry.path)
+                self.log(f"Queued {entry.path}.")
+
+    def reference(self) -> dict:
+        """Returns the reference data, fetched again once it is older than REFERENCE_TTL."""
+        if not (self.validate and self.reference_check):
+            return None
+        refresh = (
+            self.reference_loaded is not None
+            and time.monotonic() - self.reference_loaded > REFERENCE_TTL
+        )
+        if self.reference_loaded is None or refresh:
+            self.api.reference_data(refresh=refresh)
+            self.reference_loaded = time.monotonic()
+        return self.api.reference
+
+    def process(self, filepath: str) -> None:
+        """Validates, transforms and uploads one file. Writes <file>.report.csv (and <file>.validation_report.csv for invalid rows) next to it. Files are recorded in the state file, so they are only processed again once they change; a cancelled upload is not recorded and resumes from its journal."""
+        stat = os.stat(filepath)
+        state = {
+            "signature": [stat.st_size, stat.st_mtime],
+            "processed_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        try:
+            transform_data = TransformData(
+                filepath=filepath,
+                validate=self.validate,
+                base_url=self.api.base_url,
+                reference=self.reference(),
+                row_cache=self.row_cache,
+            )
+            data = transform_data.Output()
+        except (AttributeError, ValueError) as error_message:
+            self.log(
+                f"Unexpected input in {filepath}: {error_message}. Import file not correctly formatted."
+            )
+            state["status"] = "unreadable"
+        else:
+            if transform_data.invalid_count:
+                transform_data.ExportViolations(
+                    path=f"{filepath}.validation_report.csv"
+                )
+            self.log(transform_data.Report())
+            if self.stop_event.is_set():
+                # stop() arrived during validation; the file is not recorded, so it is picked up next time.
+                return
+
+            with Journal.for_input(filepath) as journal:
+                self.api.post_data(
+                    data=data,
+                    concurrency=self.concurrency,
+                    journal=journal,
+                    report_path=f"{filepath}.report.csv",
+                )
+            self.log(self.api.report())
+            if self.api.cancelled:
+                return
+            state.update(
+                status="uploaded",
+                records=self.api.processed,
+                invalid=transform_data.invalid_count,
+                failed=self.api.dead_letters,
+            )
+
+        self.processed[filepath] = state
+        self._save_state()
+
+    def run(self, once: bool = False) -> None:
+        """Polls the directory every `interval` seconds until stop() is called. With `once`, processes the files present now and returns."""
+        self.log(f"Watching {self.directory} for new files.")
+        if once:
+            self.settle = 0
+        while not self.stop_event.is_set():
+            self.scan()
+            if once:
+                self.scan()  # A second look confirms the files are stable.
+            while self.pending and not self.stop_event.is_set():
+                filepath = self.pending.popleft()
+                self.log(f"Processing {filepath}.")
+                try:
+                    self.process(filepath)
+                except Exception as error_message:
+                    # E.g. a failed re-login during an auth outage. The file is not recorded, so it is retried on a later scan.
+                    self.log(
+                        f"Could not process {filepath}: {type(error_message).__name__}: {error_message}"
+                    )
+            if once:
+                break
+            self.stop_event.wait(timeout=self.interval)
+        self.log("Stopped watching.")
+
+    def stop(self) -> None:
+        """Stops after the requests in flight; the journal lets the interrupted file resume next time."""
+        self.stop_event.set()
+        self.api.cancel()